@@ -22,6 +22,16 @@ DATABASES = {
     }
 }
 
+# read-only copy of the published site that public pages read from once
+# publish_snapshot has written it (see thoughts/snapshot.py)
+if os.environ.get('THOUGHTS_SNAPSHOT'):
+    DATABASES['snapshot'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['THOUGHTS_SNAPSHOT'],
+    }
+
+DATABASE_ROUTERS = ['thoughts.snapshot.SnapshotRouter']
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -95,15 +105,18 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'thoughts.instrumentation.InstrumentationMiddleware',
+    'thoughts.snapshot.SnapshotMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 )
 
-ROOT_URLCONF = 'brianhicks.urls'
+# workers that only serve the public site can set DJANGO_ROOT_URLCONF to
+# brianhicks.urls_public, which leaves the admin unloaded
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'brianhicks.urls')
 
 TEMPLATE_DIRS = (
     os.path.join(PROJECT_PATH, 'templates')
@@ -122,14 +135,37 @@ INSTALLED_APPS = (
     
     # third party
     'south',
-    'debug_toolbar',
     
     # my stuff
     'thoughts',
 )
 
+if ROOT_URLCONF == 'brianhicks.urls_public':
+    # nothing a public worker serves uses the admin, so don't load its models either
+    INSTALLED_APPS = tuple(app for app in INSTALLED_APPS if not app.startswith('django.contrib.admin'))
+
 INTERNAL_IPS = ('127.0.0.1')
 
+# cache whole rendered thoughts pages in the cache backend (see thoughts/cache.py).
+# Saves expire pages through the cache, so only turn this on with a backend
+# every process shares, e.g.
+#     CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#                           'LOCATION': '127.0.0.1:11211'}}
+# With the default per-process locmem cache, other workers keep serving
+# stale pages until THOUGHTS_CACHE_TIMEOUT runs out.
+THOUGHTS_CACHE_RESPONSES = False
+
+# share of requests thoughts.instrumentation measures, and how often (in
+# seconds) it logs what it has seen; the totals are also at /admin/stats/
+THOUGHTS_INSTRUMENTATION_SAMPLE_RATE = DEBUG and 1.0 or 0.1
+THOUGHTS_INSTRUMENTATION_LOG_INTERVAL = 300
+
+# render Markdown on background threads instead of in Thought.save(), so
+# admin saves of long posts return straight away (see thoughts/tasks.py);
+# drain_render_queue finishes whatever a process leaves behind
+THOUGHTS_ASYNC_RENDER = False
+THOUGHTS_RENDER_WORKERS = 2
+
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
 # the site admins on every HTTP 500 error.
@@ -142,6 +178,10 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler'
         }
     },
     'loggers': {
@@ -150,5 +190,15 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'thoughts.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'thoughts.tasks': {
+            'handlers': ['mail_admins'],
+            'level': 'ERROR',
+            'propagate': True,
+        },
     }
 }
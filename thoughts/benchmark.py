@@ -0,0 +1,228 @@
+'''
+synthetic corpora and measurements for the benchmark_thoughts command.
+
+Everything here is seeded, so two runs at the same size build the same
+corpus and hit the same URLs; only the code under test should change the
+numbers.
+'''
+import datetime
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.client import Client
+
+from thoughts import bulk, lookup, rendering, search
+from thoughts.models import ArchiveCount, Thought
+
+WORDS = ('thought code python django markdown pygments render cache index query page archive '
+         'feed search slug date year month day sqlite pelican coast river mountain coffee '
+         'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor').split()
+
+CODE = {
+    'python': ['def handler(request):', '    items = [i * 2 for i in range(10)]', '    return sum(items)',
+               'class Thing(object):', '    pass', 'import os', 'print("hello")'],
+    'javascript': ['function handler(e) {', '  var x = e.target;', '  return x.value;', '}',
+                   'var items = [1, 2, 3].map(function (i) { return i * 2; });'],
+    'bash': ['for f in *.txt; do', '  wc -l "$f"', 'done', 'export PATH="$HOME/bin:$PATH"'],
+}
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for i in range(rng.randint(words // 2, words)))
+    return text[0].upper() + text[1:] + '.'
+
+def document(rng):
+    '''a Markdown post with headers, lists, indented code blocks and footnotes'''
+    blocks, footnotes = [], []
+    for section in range(rng.randint(2, 6)):
+        blocks.append('## ' + sentence(rng, 5).rstrip('.'))
+        for paragraph in range(rng.randint(1, 4)):
+            text = ' '.join(sentence(rng) for i in range(rng.randint(2, 5)))
+            if rng.random() < 0.3:
+                label = 'note%s' % (len(footnotes) + 1)
+                text += '[^%s]' % label
+                footnotes.append('[^%s]: %s' % (label, sentence(rng)))
+            if rng.random() < 0.3:
+                text = text.replace(' ', ' *', 1).replace('.', '*.', 1)
+            blocks.append(text)
+        if rng.random() < 0.6:
+            language = rng.choice(sorted(CODE))
+            lines = [rng.choice(CODE[language]) for i in range(rng.randint(3, 12))]
+            blocks.append('\n'.join(['    :::' + language] + ['    ' + line for line in lines]))
+        if rng.random() < 0.4:
+            blocks.append('\n'.join('* ' + sentence(rng, 6) for i in range(rng.randint(2, 5))))
+    return '\n\n'.join(blocks + footnotes)
+
+def generate_corpus(size, seed=0, templates=200, batch_size=5000):
+    '''
+    insert `size` thoughts into the current database. Markdown is drawn from a
+    pool of `templates` documents, each rendered once; every other column is
+    filled in exactly as save() would.
+    '''
+    rng = random.Random(seed)
+    sources = [document(rng) for i in range(templates)]
+    rendered = [rendering.render(source) for source in sources]
+
+    now = datetime.datetime.now()
+    span = 15 * 365 * 24 * 60 * 60
+    batch = []
+    for i in range(size):
+        template = rng.randrange(templates)
+        pub_date = now - datetime.timedelta(seconds=rng.randrange(span), microseconds=rng.randrange(1000000))
+        thought = Thought(title=sentence(rng, 6)[:80], slug='thought-%s' % i, published=rng.random() < 0.9,
+                          pub_date=pub_date, pub_day=pub_date.date(), modified=pub_date, content=sources[template])
+        thought.apply_rendered(rendered[template])
+        batch.append(thought)
+        if len(batch) >= batch_size:
+            insert_rows(batch)
+            batch = []
+    insert_rows(batch)
+
+    ArchiveCount.objects.rebuild()
+    Thought.objects.rebuild_neighbours()
+    search.rebuild()
+    lookup.detail_pks.clear()
+    return sources
+
+def insert_rows(thoughts):
+    with transaction.commit_on_success():
+        bulk.insert(thoughts)
+
+def endpoint_urls(url_name, rng, samples):
+    '''URLs to request for a URL name in thoughts/urls.py, or None if unknown'''
+    visible = Thought.objects.published().filter(pub_date__lte=datetime.datetime.now())
+    busiest = lambda kind: ArchiveCount.objects.filter(kind=kind, date__lte=datetime.date.today()).order_by('-count')[0].date
+
+    if url_name == 'thoughts':
+        pages = max(1, visible.count() // 10)
+        return [reverse('thoughts'), '%s?page=%s' % (reverse('thoughts'), pages // 2 or 1)]
+    if url_name == 'thoughts_year':
+        return [reverse('thoughts_year', args=[busiest('year').year])]
+    if url_name == 'thoughts_month':
+        month = busiest('month')
+        return [reverse('thoughts_month', args=[month.year, month.strftime('%b')])]
+    if url_name == 'thoughts_day':
+        day = busiest('day')
+        return [reverse('thoughts_day', args=[day.year, day.strftime('%b'), day.strftime('%d')])]
+    if url_name == 'thought':
+        ids = list(visible.values_list('pk', flat=True)[:5000])
+        chosen = [rng.choice(ids) for i in range(samples)]
+        return [t.get_permalink() for t in Thought.objects.in_bulk(chosen).values()]
+    if url_name in ('thoughts_atom', 'thoughts_rss'):
+        return [reverse(url_name)]
+    if url_name in ('thoughts_sitemap', 'thoughts_sitemap_archives'):
+        return [reverse(url_name)]
+    if url_name == 'thoughts_sitemap_shard':
+        return [reverse(url_name, args=[0])]
+    if url_name == 'thoughts_search':
+        return ['%s?q=%s' % (reverse(url_name), word) for word in ('pelican', 'python cache', 'coffee')]
+    return None
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def measure_endpoint(urls, requests):
+    client = Client()
+    for url in urls:
+        client.get(url)
+
+    latencies, queries, sql_time = [], [], []
+    connection.use_debug_cursor = True
+    try:
+        for i in range(requests):
+            url = urls[i % len(urls)]
+            start = time.time()
+            response = client.get(url)
+            response.content
+            latencies.append(time.time() - start)
+            queries.append(len(connection.queries))
+            sql_time.append(sum(float(q['time']) for q in connection.queries))
+            if response.status_code != 200:
+                raise ValueError('%s returned %s' % (url, response.status_code))
+    finally:
+        connection.use_debug_cursor = None
+
+    return {
+        'urls': urls[:5],
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries_per_request': round(float(sum(queries)) / len(queries), 2),
+        'sql_ms_per_request': round(sum(sql_time) * 1000 / len(sql_time), 3),
+    }
+
+# measure_endpoint() in a fresh interpreter, so the peak RSS is one endpoint's
+ENDPOINT_PROBE = r'''
+import json, sys
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = sys.argv[1]
+settings.DEBUG = False
+from thoughts import benchmark
+stats = benchmark.measure_endpoint(json.loads(sys.argv[2]), int(sys.argv[3]))
+stats['peak_rss_kb'] = benchmark.peak_rss_kb()
+print json.dumps(stats)
+'''
+
+def measure_endpoint_process(urls, requests, database):
+    '''
+    measure_endpoint() against the SQLite file `database`, in its own worker
+    process, plus that process's peak RSS
+    '''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path),
+               DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+    probe = subprocess.Popen([sys.executable, '-c', ENDPOINT_PROBE, database, json.dumps(urls), str(requests)],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = probe.communicate()
+    if probe.returncode:
+        raise ValueError('measuring %s failed:\n%s' % (urls[0], err))
+    return json.loads(out.strip().splitlines()[-1])
+
+def peak_rss_kb():
+    '''
+    this process's high-water mark. Linux carries ru_maxrss over an exec, so
+    a worker would start at its parent's figure; VmHWM starts afresh.
+    '''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure_rendering(sources, repeat=3):
+    '''render_markdown throughput, straight through and via the render cache'''
+    size = sum(len(source) for source in sources)
+    results = {'documents': len(sources), 'bytes': size}
+
+    start = time.time()
+    for i in range(repeat):
+        for source in sources:
+            rendering.render(source)
+    elapsed = time.time() - start
+    results['uncached_docs_per_s'] = round(len(sources) * repeat / elapsed, 1)
+    results['uncached_kb_per_s'] = round(size * repeat / elapsed / 1024, 1)
+
+    thought = Thought()
+    for source in sources:
+        thought.render_markdown(source)
+    start = time.time()
+    for i in range(repeat):
+        for source in sources:
+            thought.render_markdown(source)
+    elapsed = time.time() - start
+    results['cached_docs_per_s'] = round(len(sources) * repeat / elapsed, 1)
+    return results
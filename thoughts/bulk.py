@@ -0,0 +1,44 @@
+'''
+multi-row INSERT and UPDATE for Thoughts through executemany, for commands
+that write thousands of rows at once. This version of Django has no
+bulk_create, and saving one at a time means one statement (and, outside a
+transaction, one commit) per row.
+
+Rows are written exactly as given: save() isn't called and no signals fire,
+so callers fill in the derived columns (pub_day, modified, apply_rendered())
+themselves and refresh ArchiveCount, the search index and the response cache
+afterwards.
+'''
+from django.db import connection, transaction
+from django.db.models import AutoField
+
+from thoughts.models import Thought
+
+def columns(fields):
+    qn = connection.ops.quote_name
+    return [qn(field.column) for field in fields]
+
+def values(instance, fields, add):
+    return [field.get_db_prep_save(field.pre_save(instance, add), connection=connection) for field in fields]
+
+def insert(thoughts):
+    '''insert new thoughts; their primary keys are not read back'''
+    if not thoughts:
+        return
+    fields = [field for field in Thought._meta.local_fields if not isinstance(field, AutoField)]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(Thought._meta.db_table), ', '.join(columns(fields)), ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [values(thought, fields, True) for thought in thoughts])
+    transaction.commit_unless_managed()
+
+def update(thoughts):
+    '''write every column of existing thoughts, by primary key'''
+    if not thoughts:
+        return
+    fields = [field for field in Thought._meta.local_fields if not field.primary_key]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        connection.ops.quote_name(Thought._meta.db_table),
+        ', '.join('%s = %%s' % column for column in columns(fields)),
+        connection.ops.quote_name(Thought._meta.pk.column))
+    connection.cursor().executemany(sql, [values(thought, fields, False) + [thought.pk] for thought in thoughts])
+    transaction.commit_unless_managed()
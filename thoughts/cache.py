@@ -0,0 +1,74 @@
+'''
+generational full-response cache for the thoughts views.
+
+Every cached page is keyed by the generation numbers of the scopes it depends
+on (the global index, its year, month, day or the thought itself). Changing a
+thought bumps the generations of the scopes it touches, which moves the
+affected pages to fresh keys; the old entries are never looked up again and
+simply age out of the backend. No flushing, no key scanning.
+'''
+import hashlib
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+
+GENERATION_KEY = 'thoughts:generation:%s'
+RESPONSE_KEY = 'thoughts:response:%s:%s'
+
+# generations should outlive the pages keyed on them; 30 days is as long as
+# memcached will take as a relative timeout
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+# per-process hit/miss counters, by URL name
+stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+def scopes_for(published, pub_date, slug):
+    '''the scopes a published thought appears in'''
+    if not published or not pub_date:
+        return []
+    return [
+        'index',
+        pub_date.strftime('year:%Y'),
+        pub_date.strftime('month:%Y-%m'),
+        pub_date.strftime('day:%Y-%m-%d'),
+        thought_scope(pub_date, slug),
+    ]
+
+def thought_scope(pub_date, slug):
+    '''the scope of a thought's own page'''
+    return pub_date.strftime('thought:%Y-%m-%d:') + unicode(slug)
+
+def new_generation():
+    # start from the clock rather than 1 so a scope whose counter was evicted
+    # can never come back to a generation that still has pages cached
+    return int(time.time() * 1000)
+
+def generations(scopes):
+    keys = [GENERATION_KEY % scope for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, new_generation(), GENERATION_TIMEOUT)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+def bump(scopes):
+    for scope in set(scopes):
+        try:
+            cache.incr(GENERATION_KEY % scope)
+        except ValueError:
+            # nothing cached under this scope yet
+            pass
+
+def response_key(url_name, path, scopes):
+    parts = [path] + ['%s=%s' % pair for pair in zip(scopes, generations(scopes))]
+    return RESPONSE_KEY % (url_name, hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest())
+
+def hit_rates():
+    '''{url name: {'hits', 'misses', 'hit_rate'}} for this process'''
+    rates = {}
+    for url_name, counts in stats.items():
+        total = counts['hits'] + counts['misses']
+        rates[url_name] = dict(counts, hit_rate=total and float(counts['hits']) / total or 0.0)
+    return rates
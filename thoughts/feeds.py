@@ -0,0 +1,60 @@
+'''
+Atom and RSS feeds of published thoughts.
+
+Each entry was rendered when its thought was saved (Thought.atom_entry and
+Thought.rss_item), so a feed is just a header, the stored fragments straight
+out of the database, and a footer, streamed as it's read.
+'''
+import datetime
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.views.decorators.http import condition
+
+from thoughts.models import Thought
+
+FEED_LENGTH = getattr(settings, 'THOUGHTS_FEED_LENGTH', 20)
+
+def visible_thoughts():
+    return Thought.objects.published().filter(pub_date__lte=datetime.datetime.now())
+
+def last_modified(request, *args, **kwargs):
+    '''the newest thought to appear or change; None when there are none'''
+    found = visible_thoughts().aggregate(pub_date=Max('pub_date'), modified=Max('modified'))
+    if found['pub_date'] is None:
+        return None
+    return max(found['pub_date'], found['modified'])
+
+def stream_feed(request, kind, footer):
+    updated = last_modified(request) or datetime.datetime.now()
+    domain = Site.objects.get_current().domain
+    header = render_to_string('thoughts/feeds/%s_header.xml' % kind, {
+        'link': 'http://%s%s' % (domain, reverse('thoughts')),
+        'feed_link': 'http://%s%s' % (domain, request.path),
+        'updated': rfc3339_date(updated),
+        'last_build_date': rfc2822_date(updated),
+    })
+    
+    column = kind == 'atom' and 'atom_entry' or 'rss_item'
+    # thoughts still in the render queue for the first time have no entry yet
+    entries = visible_thoughts().exclude(**{column: ''}).values_list(column, flat=True)
+    if FEED_LENGTH:
+        entries = entries[:FEED_LENGTH]
+        
+    yield header.encode('utf-8')
+    for entry in entries.iterator():
+        yield entry.encode('utf-8') + '\n'
+    yield footer
+    
+@condition(last_modified_func=last_modified)
+def atom(request):
+    return HttpResponse(stream_feed(request, 'atom', '</feed>\n'), content_type='application/atom+xml; charset=utf-8')
+    
+@condition(last_modified_func=last_modified)
+def rss(request):
+    return HttpResponse(stream_feed(request, 'rss', '</channel>\n</rss>\n'), content_type='application/rss+xml; charset=utf-8')
@@ -0,0 +1,126 @@
+'''
+codehilite, with the Pygments work cached per code block.
+
+Highlighting a block depends only on its language, its code and the
+formatter options, so the HTML for each distinct block is kept in a
+byte-bounded LRU and reused across renders. A post whose prose changed, or
+that shares a snippet with another post, only highlights blocks nobody has
+seen yet. Lexers and formatters are built once and shared. The output is
+exactly what the stock extension produces.
+'''
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from markdown.extensions import codehilite
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, guess_lexer, TextLexer
+
+class SizedLRUCache(object):
+    '''a least-recently-used mapping bounded by the total length of its keys and values'''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def weigh(self, key, value):
+        return sum(len(part) for part in key if isinstance(part, basestring)) + len(value)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        weight = self.weigh(key, value)
+        if weight > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.weigh(key, self.entries.pop(key))
+            self.entries[key] = value
+            self.size += weight
+            while self.size > self.max_size:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.size -= self.weigh(old_key, old_value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size}
+
+blocks = SizedLRUCache(getattr(settings, 'THOUGHTS_HIGHLIGHT_CACHE_SIZE', 8 * 1024 * 1024))
+
+lexers = {}
+formatters = {}
+
+def lexer_for(lang, src):
+    '''the lexer codehilite would pick, shared when it's picked by name'''
+    if lang not in lexers:
+        try:
+            lexers[lang] = get_lexer_by_name(lang)
+        except ValueError:
+            lexers[lang] = None
+    if lexers[lang] is not None:
+        return lexers[lang]
+    try:
+        return guess_lexer(src)
+    except ValueError:
+        return TextLexer()
+
+def formatter_for(linenos, css_class):
+    key = (linenos, css_class)
+    if key not in formatters:
+        formatters[key] = HtmlFormatter(linenos=linenos, cssclass=css_class)
+    return formatters[key]
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    def hilite(self):
+        self.src = self.src.strip('\n')
+        self._getLang()
+
+        key = (self.lang, self.src, self.linenos, self.css_class)
+        html = blocks.get(key)
+        if html is None:
+            html = highlight(self.src, lexer_for(self.lang, self.src), formatter_for(self.linenos, self.css_class))
+            blocks.set(key, html)
+        return html
+
+class HiliteTreeprocessor(codehilite.HiliteTreeprocessor):
+    def run(self, root):
+        for block in root.getiterator('pre'):
+            children = block.getchildren()
+            if len(children) == 1 and children[0].tag == 'code':
+                code = CachedCodeHilite(children[0].text,
+                                        linenos=self.config['force_linenos'][0],
+                                        css_class=self.config['css_class'][0])
+                placeholder = self.markdown.htmlStash.store(code.hilite(), safe=True)
+                # same as codehilite: the <pre> becomes a <p> holding the placeholder
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+class CodeHiliteExtension(codehilite.CodeHiliteExtension):
+    def extendMarkdown(self, md, md_globals):
+        hiliter = HiliteTreeprocessor(md)
+        hiliter.config = self.config
+        md.treeprocessors.add('hilite', hiliter, '_begin')
+
+def makeExtension(configs={}):
+    return CodeHiliteExtension(configs=configs)
@@ -0,0 +1,128 @@
+'''
+block-level incremental rendering.
+
+A document is split into runs of top-level blocks that Markdown parses
+independently of each other, and the HTML for each run is kept in a
+byte-bounded LRU keyed by its source. Re-rendering a long post after an edit
+only parses (and highlights) the runs that changed; the rest are stitched
+back in from the cache.
+
+The output is exactly what a full render produces:
+
+ * a block that continues its predecessor (indented code or list content, a
+   blockquote or list item that joins the one before it, blank-line runs
+   that extend a code block) is kept in the same run;
+ * reference and footnote definitions are collected from the whole document
+   first, and runs that could use them are keyed by them, so footnote
+   numbers and reference links come out as before;
+ * the footnote section is rendered on its own and appended at the end, as
+   the footnotes extension does.
+
+Documents with raw HTML blocks or a footnote place marker are rendered in
+one piece, since both tie blocks together in ways the split can't see.
+'''
+import codecs
+import hashlib
+import re
+
+import markdown
+from django.conf import settings
+from markdown.extensions.footnotes import FootnoteExtension
+
+from thoughts import highlight, rendering
+
+blocks = highlight.SizedLRUCache(getattr(settings, 'THOUGHTS_BLOCK_CACHE_SIZE', 8 * 1024 * 1024))
+
+# a block starting like this may attach itself to the previous block's
+# element: indented code and list content, blockquotes, list items and empty
+# blocks all look at their preceding sibling
+CONTINUES_RE = re.compile(r'^(\s|>|[*+-][ ]|\d+\.[ ])')
+
+def split(text):
+    '''split preprocessed text into runs of blocks that parse the same on their own'''
+    runs = []
+    for block in text.split('\n\n'):
+        if runs and (not block or CONTINUES_RE.match(block)):
+            runs[-1].append(block)
+        else:
+            runs.append([block])
+    return ['\n\n'.join(run) for run in runs]
+
+def footnotes_of(md):
+    for extension in md.registeredExtensions:
+        if isinstance(extension, FootnoteExtension):
+            return extension
+    return None
+
+def serialize(md, root):
+    '''what convert() makes of `root`, before the final strip'''
+    # only the document's first element gets a leading newline
+    root.text = None
+    output, length = codecs.utf_8_decode(md.serializer(root, encoding='utf-8'))
+    try:
+        output = output[output.index('<%s>' % markdown.DOC_TAG) + len(markdown.DOC_TAG) + 2:
+                        output.rindex('</%s>' % markdown.DOC_TAG)]
+    except ValueError:
+        # an empty run
+        output = u''
+    for postprocessor in md.postprocessors.values():
+        output = postprocessor.run(output)
+    return output
+
+def render_run(md, text):
+    md.htmlStash.reset()
+    root = markdown.etree.Element(markdown.DOC_TAG)
+    md.parser.parseChunk(root, text)
+    for name, treeprocessor in md.treeprocessors.items():
+        # the footnote section is rendered once, by render_footnotes()
+        if name != 'footnote':
+            root = treeprocessor.run(root) or root
+    return serialize(md, root)
+
+def render_footnotes(md):
+    md.htmlStash.reset()
+    root = markdown.etree.Element(markdown.DOC_TAG)
+    for treeprocessor in md.treeprocessors.values():
+        root = treeprocessor.run(root) or root
+    return serialize(md, root)
+
+def render(source):
+    '''render Markdown source to HTML, reusing cached runs of blocks'''
+    source = unicode(source)
+    if not source.strip():
+        return u''
+    md = markdown.Markdown(extensions=rendering.extensions())
+    footnotes = footnotes_of(md)
+    if footnotes and footnotes.getConfig('PLACE_MARKER') in source:
+        return md.convert(source)
+
+    # the same preparation as Markdown.convert()
+    text = source.replace(markdown.STX, '').replace(markdown.ETX, '')
+    text = text.replace('\r\n', '\n').replace('\r', '\n') + '\n\n'
+    text = re.sub(r'\n\s+\n', '\n\n', text)
+    text = text.expandtabs(markdown.TAB_LENGTH)
+    lines = text.split('\n')
+    for preprocessor in md.preprocessors.values():
+        lines = preprocessor.run(lines)
+    if md.htmlStash.html_counter:
+        md.reset()
+        return md.convert(source)
+
+    # everything outside a run that can change its HTML
+    context = repr((sorted(md.references.items()), footnotes and footnotes.footnotes.keys()))
+    output = []
+    for run in split('\n'.join(lines)):
+        digest = hashlib.sha1()
+        digest.update(rendering.versions())
+        if '[' in run:
+            digest.update(context.encode('utf-8'))
+        digest.update(run.encode('utf-8'))
+        key = (digest.hexdigest(),)
+        html = blocks.get(key)
+        if html is None:
+            html = render_run(md, run)
+            blocks.set(key, html)
+        output.append(html)
+    if footnotes and footnotes.footnotes.keys():
+        output.append(render_footnotes(md))
+    return u''.join(output).strip()
@@ -0,0 +1,200 @@
+'''
+sampled, in-memory request instrumentation that is cheap enough to leave on
+in production.
+
+InstrumentationMiddleware picks THOUGHTS_INSTRUMENTATION_SAMPLE_RATE of all
+requests and records, per resolved URL name: a latency histogram, SQL query
+count and time, template render time and time spent rendering Markdown.
+Everything is aggregated per process into fixed-size records, so memory only
+grows with the number of URL names. The totals are served as JSON to staff at
+stats(), and logged to the thoughts.instrumentation logger every
+THOUGHTS_INSTRUMENTATION_LOG_INTERVAL seconds.
+'''
+import logging
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connections
+from django.http import HttpResponse
+
+from thoughts import cache
+
+logger = logging.getLogger('thoughts.instrumentation')
+
+# upper bounds of the latency histogram buckets, in milliseconds; the last
+# bucket catches everything slower
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+TIMERS = ('sql', 'template', 'markdown')
+
+class Record(object):
+    '''running totals for one URL name'''
+    def __init__(self):
+        self.requests = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.timers = dict((name, 0.0) for name in TIMERS)
+
+    def add(self, elapsed_ms, queries, timers):
+        self.requests += 1
+        self.histogram[bucket_for(elapsed_ms)] += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.queries += queries
+        for name, value in timers.items():
+            self.timers[name] += value
+
+    def percentile(self, fraction):
+        '''upper bound of the bucket holding the given fraction of requests'''
+        wanted = fraction * self.requests
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return index < len(BUCKETS) and BUCKETS[index] or None
+        return None
+
+    def summary(self):
+        requests = self.requests or 1
+        summary = {
+            'requests': self.requests,
+            'histogram': dict(zip([str(bound) for bound in BUCKETS] + ['slower'], self.histogram)),
+            'mean_ms': round(self.total_ms / requests, 3),
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'queries_per_request': round(float(self.queries) / requests, 2),
+        }
+        for name in TIMERS:
+            summary['%s_ms_per_request' % name] = round(self.timers[name] / requests, 3)
+        return summary
+
+def bucket_for(elapsed_ms):
+    for index, bound in enumerate(BUCKETS):
+        if elapsed_ms <= bound:
+            return index
+    return len(BUCKETS)
+
+records = {}
+lock = threading.Lock()
+last_logged = [time.time()]
+
+# the sampled request being handled on this thread, if any
+current = threading.local()
+
+def record(url_name, elapsed_ms, queries, timers):
+    with lock:
+        if url_name not in records:
+            records[url_name] = Record()
+        records[url_name].add(elapsed_ms, queries, timers)
+
+def snapshot():
+    '''{url name: summary} for this process'''
+    with lock:
+        return dict((url_name, entry.summary()) for url_name, entry in records.items())
+
+def reset():
+    with lock:
+        records.clear()
+
+@contextmanager
+def timed(name):
+    '''add the time spent in the block to the current sampled request, if any'''
+    timers = getattr(current, 'timers', None)
+    if timers is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timers[name] += (time.time() - start) * 1000
+
+class InstrumentationMiddleware(object):
+    '''
+    put this first in MIDDLEWARE_CLASSES so the latency covers every other
+    middleware too
+    '''
+    def __init__(self):
+        self.sample_rate = getattr(settings, 'THOUGHTS_INSTRUMENTATION_SAMPLE_RATE', 0.1)
+        self.log_interval = getattr(settings, 'THOUGHTS_INSTRUMENTATION_LOG_INTERVAL', 300)
+
+    def process_request(self, request):
+        current.timers = None
+        if random.random() >= self.sample_rate:
+            return
+        # the debug cursor is what counts queries; it is only on for sampled requests
+        current.queries = {}
+        for connection in connections.all():
+            current.queries[connection.alias] = (connection.use_debug_cursor, len(connection.queries))
+            connection.use_debug_cursor = True
+        current.timers = dict((name, 0.0) for name in TIMERS)
+        current.start = time.time()
+
+    def process_template_response(self, request, response):
+        timers = getattr(current, 'timers', None)
+        if timers is not None:
+            start = time.time()
+            def rendered(response):
+                timers['template'] += (time.time() - start) * 1000
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        timers = getattr(current, 'timers', None)
+        if timers is None:
+            return response
+        current.timers = None
+        elapsed_ms = (time.time() - current.start) * 1000
+
+        queries = 0
+        for connection in connections.all():
+            use_debug_cursor, first = current.queries.get(connection.alias, (None, 0))
+            executed = connection.queries[first:]
+            queries += len(executed)
+            timers['sql'] += sum(float(query['time']) for query in executed) * 1000
+            connection.use_debug_cursor = use_debug_cursor
+
+        try:
+            url_name = resolve(request.path_info).url_name or '<unnamed>'
+        except Resolver404:
+            url_name = '<unresolved>'
+        record(url_name, elapsed_ms, queries, timers)
+
+        if self.log_interval and time.time() - last_logged[0] >= self.log_interval:
+            last_logged[0] = time.time()
+            logger.info(json.dumps(snapshot(), sort_keys=True))
+        return response
+
+def stats(request):
+    '''this process's request, response cache and render cache statistics, for staff'''
+    # imported here so public workers never load the admin
+    from django.contrib.admin.views.decorators import staff_member_required
+    return staff_member_required(stats_json)(request)
+
+def stats_json(request):
+    from thoughts.models import RenderCache
+    # only loaded by processes that have rendered something
+    highlight = sys.modules.get('thoughts.highlight')
+    incremental = sys.modules.get('thoughts.incremental')
+    data = {
+        'sample_rate': getattr(settings, 'THOUGHTS_INSTRUMENTATION_SAMPLE_RATE', 0.1),
+        'requests': snapshot(),
+        'response_cache': cache.hit_rates(),
+        'render_cache': RenderCache.objects.stats(),
+        'highlight_cache': highlight and highlight.blocks.stats(),
+        'block_cache': incremental and incremental.blocks.stats(),
+    }
+    return HttpResponse(json.dumps(data, indent=2, sort_keys=True), content_type='application/json')
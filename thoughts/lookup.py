@@ -0,0 +1,60 @@
+'''
+in-process map from a detail URL's (day, slug) to the thought's primary key,
+so hot posts are served with a single primary key fetch.
+
+Entries are dropped when their thought is saved or deleted in this process.
+Other processes can still hold stale entries, so callers must check the row
+they fetch actually matches before trusting it.
+'''
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+class LRUCache(object):
+    '''a size-bounded least-recently-used mapping that can also forget by value'''
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.keys_by_value = {}
+        self.lock = threading.Lock()
+        
+    def __len__(self):
+        return len(self.entries)
+        
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return default
+            self.entries[key] = value
+            return value
+            
+    def set(self, key, value):
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = value
+            self.keys_by_value.setdefault(value, set()).add(key)
+            while len(self.entries) > self.size:
+                self._remove(next(iter(self.entries)))
+                
+    def discard_value(self, value):
+        with self.lock:
+            for key in list(self.keys_by_value.get(value, ())):
+                self._remove(key)
+                
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_value.clear()
+            
+    def _remove(self, key):
+        if key in self.entries:
+            value = self.entries.pop(key)
+            keys = self.keys_by_value[value]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_value[value]
+                
+detail_pks = LRUCache(getattr(settings, 'THOUGHTS_DETAIL_LOOKUP_SIZE', 1000))
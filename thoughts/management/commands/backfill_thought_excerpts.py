@@ -0,0 +1,70 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from thoughts import cache
+from thoughts.models import Thought
+
+class Command(BaseCommand):
+    help = ('Fill in the excerpt, word count, reading time and list item columns (and the feed '
+            'entries, which carry the modification time) from the HTML already stored on each '
+            'Thought. Markdown is not rendered again.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Number of thoughts to write per transaction.'),
+        make_option('--all', dest='all', action='store_true', default=False,
+            help='Redo every thought, not just the ones without a list item.'),
+    )
+    
+    # everything apply_rendered() derives from html_content
+    FIELDS = [field for field in Thought.RENDERED_FIELDS if field != 'html_content']
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        
+        # pending thoughts get all of this when the render queue reaches them
+        thoughts = Thought.objects.filter(render_pending=False).order_by('pk')
+        if not options['all']:
+            thoughts = thoughts.filter(list_item='')
+        
+        last_pk, seen, updated = 0, 0, 0
+        while True:
+            batch = list(thoughts.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            
+            now = datetime.datetime.now()
+            changes, scopes = [], []
+            for thought in batch:
+                saved = thought.modified
+                thought.modified = now
+                thought.apply_rendered(thought.html_content)
+                changes.append([getattr(thought, field) for field in self.FIELDS] + [now, thought.pk, saved])
+                scopes += cache.scopes_for(thought.published, thought.pub_date, thought.slug)
+            
+            updated += self.write_batch(changes)
+            cache.bump(scopes)
+            seen += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write('%s thoughts backfilled (through pk %s)\n' % (seen, last_pk))
+        
+        if updated < seen:
+            self.stdout.write('%s were saved while this ran and were left alone\n' % (seen - updated))
+            
+    def write_batch(self, changes):
+        '''write the changes, skipping rows saved since they were read; returns how many were written'''
+        qn = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s WHERE %s = %%s AND %s = %%s' % (
+            qn(Thought._meta.db_table),
+            ', '.join('%s = %%s' % qn(column) for column in self.FIELDS + ['modified']),
+            qn(Thought._meta.pk.column),
+            qn('modified'))
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            cursor.executemany(sql, changes)
+            transaction.set_dirty()
+        return cursor.rowcount
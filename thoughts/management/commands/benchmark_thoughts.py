@@ -0,0 +1,120 @@
+import datetime
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import django
+import markdown
+import pygments
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from thoughts import benchmark, urls as thought_urls
+
+class Command(BaseCommand):
+    help = ('Build throwaway corpora of synthetic thoughts and time every thoughts URL '
+            'against them, reporting p50/p99 latency, queries per request, peak memory '
+            'and Markdown rendering throughput as JSON.')
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='1000',
+            help='Comma separated corpus sizes, e.g. 1000,100000,1000000.'),
+        make_option('--requests', dest='requests', type='int', default=50,
+            help='Timed requests per URL name.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+            help='Seed for the corpus and the URLs requested.'),
+        make_option('--output', dest='output', default='benchmark-results.json',
+            help='File to write the results to.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers')
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+
+        results = {'meta': self.meta(options), 'runs': []}
+        for size in sizes:
+            results['runs'].append(self.run(size, options))
+
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        self.stdout.write('results written to %s\n' % options['output'])
+
+    def run(self, size, options):
+        '''benchmark one corpus size in its own scratch database'''
+        from south.management.commands import patch_for_test_db_setup
+
+        directory = tempfile.mkdtemp(prefix='thoughts-benchmark-')
+        old_name = connection.settings_dict['NAME']
+        old_test_name = connection.settings_dict.get('TEST_NAME')
+        old_debug = settings.DEBUG
+        connection.settings_dict['TEST_NAME'] = os.path.join(directory, 'benchmark.db')
+        patch_for_test_db_setup()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # run the views the way production does; queries are counted explicitly
+        settings.DEBUG = False
+        try:
+            start = time.time()
+            sources = benchmark.generate_corpus(size, seed=options['seed'])
+            run = {'size': size, 'corpus_seconds': round(time.time() - start, 1), 'endpoints': {}, 'skipped': []}
+            self.stdout.write('%s thoughts generated in %ss\n' % (size, run['corpus_seconds']))
+
+            rng = random.Random(options['seed'])
+            for pattern in thought_urls.urlpatterns:
+                url_name = pattern.name
+                urls = benchmark.endpoint_urls(url_name, rng, options['requests'])
+                if not urls:
+                    run['skipped'].append(url_name)
+                    continue
+                stats = run['endpoints'][url_name] = benchmark.measure_endpoint_process(
+                    urls, options['requests'], connection.settings_dict['NAME'])
+                self.stdout.write('  %-16s p50 %8.2fms  p99 %8.2fms  %5.1f queries  %7dkB peak RSS\n' % (
+                    url_name, stats['p50_ms'], stats['p99_ms'], stats['queries_per_request'], stats['peak_rss_kb']))
+
+            run['rendering'] = benchmark.measure_rendering(sources)
+            self.stdout.write('  render_markdown %(uncached_docs_per_s)s docs/s uncached, '
+                              '%(cached_docs_per_s)s docs/s cached\n' % run['rendering'])
+            run['process_peak_rss_kb'] = benchmark.peak_rss_kb()
+            self.stdout.write('  benchmark process peak RSS %skB (corpora and rendering, all sizes so far)\n'
+                              % run['process_peak_rss_kb'])
+            return run
+        finally:
+            settings.DEBUG = old_debug
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.settings_dict['TEST_NAME'] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def meta(self, options):
+        try:
+            revision = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, cwd=os.path.dirname(benchmark.__file__)).communicate()[0].strip()
+        except OSError:
+            revision = None
+        return {
+            'date': datetime.datetime.now().isoformat(),
+            'git_revision': revision or None,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'django': django.get_version(),
+            'markdown': markdown.version,
+            'pygments': pygments.__version__,
+            'database': connection.vendor,
+            'settings': settings.SETTINGS_MODULE,
+            'cache_responses': getattr(settings, 'THOUGHTS_CACHE_RESPONSES', False),
+            'sizes': options['sizes'],
+            'requests': options['requests'],
+            'seed': options['seed'],
+        }
@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from thoughts import tasks
+from thoughts.models import RenderTask
+
+class Command(BaseCommand):
+    help = 'Render every thought waiting in the background render queue, then report what is left.'
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Stop after this many tasks.'),
+        make_option('--retry-failed', dest='retry_failed', action='store_true', default=False,
+            help='Give tasks that ran out of attempts another go first.'),
+    )
+    
+    def handle(self, *args, **options):
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be at least 1')
+        if options['retry_failed']:
+            retried = RenderTask.objects.failed().update(attempts=0, claimed=None)
+            self.stdout.write('Retrying %s failed tasks\n' % retried)
+        
+        done = tasks.drain(options['limit'])
+        self.stdout.write('Processed %s tasks, %s still queued\n' % (done, RenderTask.objects.count()))
+        for task in RenderTask.objects.failed().order_by('pk'):
+            self.stdout.write('Thought %s failed %s times:\n%s\n' % (task.thought_id, task.attempts, task.error))
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from thoughts.models import Thought
+
+# what a thought is made of; everything else is derived when it's imported
+FIELDS = ('title', 'slug', 'published', 'pub_date', 'content')
+
+class Command(BaseCommand):
+    help = 'Write every Thought as JSON Lines (one object per line), in primary key order.'
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default='-',
+            help='File to write to, or - for standard output.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Number of thoughts to read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        output = options['output'] == '-' and self.stdout or open(options['output'], 'w')
+        count, last_pk = 0, 0
+        try:
+            # primary key batches: iterator() would still fetch every row at
+            # once on SQLite, which can't read in chunks
+            while True:
+                rows = list(Thought.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *FIELDS)[:batch_size])
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(FIELDS, row[1:]))
+                    record['pub_date'] = record['pub_date'].isoformat()
+                    output.write(json.dumps(record, sort_keys=True) + '\n')
+                count += len(rows)
+                last_pk = rows[-1][0]
+        finally:
+            if output is not self.stdout:
+                output.close()
+        if output is not self.stdout:
+            self.stdout.write('%s thoughts exported to %s\n' % (count, options['output']))
@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+import os
+import tempfile
+from collections import defaultdict
+from multiprocessing import Pool
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection
+from django.test.client import RequestFactory
+
+from thoughts.models import Thought
+from thoughts.views import ThoughtsIndexView, ThoughtsByYearView, ThoughtsByMonthView, ThoughtsByDayView
+
+MANIFEST = '.freeze-manifest.json'
+
+def render_url(url):
+    '''
+    render one URL straight through its view (no middleware), returning the
+    response body. Module level so the process pool can pickle it.
+    '''
+    path, _, query = url.partition('?')
+    request = RequestFactory().get(path, query and dict([query.split('=')]) or {})
+    match = resolve(path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.status_code != 200:
+        raise CommandError('%s returned %s' % (url, response.status_code))
+    return response.content
+
+class Command(BaseCommand):
+    help = ('Render every thoughts URL to static HTML. Page 1 of a listing is written to '
+            '<url>/index.html and page N to <url>/page-N.html; point nginx at them with '
+            'something like `try_files $uri/page-$arg_page.html $uri/index.html =404`.')
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=getattr(settings, 'THOUGHTS_FREEZE_ROOT', 'frozen'),
+            help='Directory to write the site to.'),
+        make_option('--full', dest='full', action='store_true', default=False,
+            help='Ignore the manifest and rewrite every page.'),
+        make_option('--processes', dest='processes', type='int', default=None,
+            help='Number of render processes (defaults to one per CPU).'),
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+            help='Thoughts to read per query while planning.'),
+    )
+
+    def handle(self, *args, **options):
+        self.output = options['output']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        manifest_path = os.path.join(self.output, MANIFEST)
+
+        manifest = {}
+        if not options['full'] and os.path.exists(manifest_path):
+            manifest = json.load(open(manifest_path))
+
+        pages = self.plan(options['batch_size'])
+        dirty = sorted(path for path, (url, signature) in pages.iteritems() if manifest.get(path) != signature)
+        stale = [path for path in manifest if path not in pages]
+
+        urls = [pages[path][0] for path in dirty]
+        if options['processes'] == 1 or len(urls) < 2:
+            bodies = map(render_url, urls)
+        else:
+            # don't hand the parent's database connection to the forked workers
+            connection.close()
+            pool = Pool(options['processes'])
+            try:
+                bodies = pool.map(render_url, urls, chunksize=16)
+            finally:
+                pool.close()
+                pool.join()
+
+        for path, body in zip(dirty, bodies):
+            self.write(path, body)
+            manifest[path] = pages[path][1]
+        for path in stale:
+            target = os.path.join(self.output, path)
+            if os.path.exists(target):
+                os.remove(target)
+            del manifest[path]
+
+        self.write(MANIFEST, json.dumps(manifest, indent=0, sort_keys=True))
+        self.stdout.write('%s pages written, %s removed, %s unchanged\n' % (
+            len(dirty), len(stale), len(pages) - len(dirty)))
+
+    def plan(self, batch_size=1000):
+        '''
+        every page of the site as {file path: (url, signature)}. The signature
+        covers exactly what the page shows, so a page only needs rewriting
+        when its signature changes.
+        '''
+        pages = {}
+        # {(listing url, page size): [(pub_date, pk, entry)]}
+        listings = defaultdict(list)
+
+        now = datetime.datetime.now()
+        thoughts = (Thought.objects.filter(published=True, pub_date__lte=now)
+                    .values_list('pk', 'title', 'slug', 'pub_date', 'html_content', 'list_item',
+                                 'previous_thought__title', 'previous_thought__slug', 'previous_thought__pub_date',
+                                 'next_thought__title', 'next_thought__slug', 'next_thought__pub_date'))
+        # primary key batches: iterator() would still fetch every body at
+        # once on SQLite
+        last_pk = 0
+        while True:
+            rows = list(thoughts.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            for row in rows:
+                self.plan_thought(row, now, pages, listings)
+
+        for (url, per_page), entries in listings.iteritems():
+            # newest first, as the listings show them
+            entries = [entry for pub_date, pk, entry in sorted(entries, reverse=True)]
+            num_pages = (len(entries) + per_page - 1) // per_page
+            for number in range(1, num_pages + 1):
+                page_url = number == 1 and url or '%s?page=%s' % (url, number)
+                signature = hashlib.sha1('%s/%s\n' % (number, num_pages))
+                signature.update(u'\n'.join(entries[(number - 1) * per_page:number * per_page]).encode('utf-8'))
+                pages[self.path_for(url, number)] = (page_url, signature.hexdigest())
+
+        return pages
+
+    def plan_thought(self, row, now, pages, listings):
+        '''add a thought's own page to `pages` and its entry to the listings it appears in'''
+        pk, title, slug, pub_date, html_content, list_item = row[:6]
+        year, month, day = str(pub_date.year), pub_date.strftime('%b'), pub_date.strftime('%d')
+        entry = u'%s|%s|%s|%s|%s' % (pk, title, slug, pub_date.isoformat(), hashlib.sha1(list_item.encode('utf-8')).hexdigest())
+        # the previous/next links, as long as the next one isn't still scheduled
+        neighbours = row[6:9]
+        if row[11] and row[11] <= now:
+            neighbours += row[9:12]
+
+        url = reverse('thought', args=[year, month, day, slug])
+        signature = hashlib.sha1(entry.encode('utf-8'))
+        signature.update(html_content.encode('utf-8'))
+        signature.update(repr(neighbours))
+        pages[self.path_for(url)] = (url, signature.hexdigest())
+
+        listed = (pub_date, pk, entry)
+        listings[(reverse('thoughts'), ThoughtsIndexView.paginate_by)].append(listed)
+        listings[(reverse('thoughts_year', args=[year]), ThoughtsByYearView.paginate_by)].append(listed)
+        listings[(reverse('thoughts_month', args=[year, month]), ThoughtsByMonthView.paginate_by)].append(listed)
+        listings[(reverse('thoughts_day', args=[year, month, day]), ThoughtsByDayView.paginate_by)].append(listed)
+
+    def path_for(self, url, page=1):
+        path = url.lstrip('/')
+        if page == 1:
+            return os.path.join(path, 'index.html')
+        return os.path.join(path, 'page-%s.html' % page)
+
+    def write(self, path, body):
+        '''write atomically so nginx never serves a half-written page'''
+        target = os.path.join(self.output, path)
+        directory = os.path.dirname(target)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.freeze-')
+        os.write(fd, body)
+        os.close(fd)
+        os.chmod(temp, 0o644)
+        os.rename(temp, target)
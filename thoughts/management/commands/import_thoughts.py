@@ -0,0 +1,130 @@
+import datetime
+import sys
+from collections import OrderedDict
+from itertools import islice
+from multiprocessing import Pool
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from thoughts import bulk, cache, lookup, rendering, search
+from thoughts.models import ArchiveCount, Thought
+
+REQUIRED = ('title', 'slug', 'pub_date', 'content')
+
+class Command(BaseCommand):
+    args = '<file.jsonl | ->'
+    help = ('Load Thoughts from JSON Lines as written by export_thoughts. A thought with the '
+            'same publication day and slug as an existing one replaces it; anything else is '
+            'added. Markdown is rendered a batch at a time across a process pool.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of thoughts to render and write per transaction.'),
+        make_option('--processes', dest='processes', type='int', default=None,
+            help='Number of render processes (defaults to one per CPU).'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the file to import, or - for standard input.')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        source = args[0] == '-' and sys.stdin or open(args[0])
+        records = (self.parse(number, line) for number, line in enumerate(source, 1) if line.strip())
+
+        pool = None
+        if options['processes'] != 1:
+            # don't hand the parent's database connection to the forked workers
+            connection.close()
+            pool = Pool(options['processes'])
+
+        created, replaced = 0, 0
+        try:
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                contents = [thought.content for thought in batch]
+                rendered = pool and pool.map(rendering.render, contents) or map(rendering.render, contents)
+                new, existing = self.write_batch(batch, rendered)
+                created += new
+                replaced += existing
+                self.stdout.write('%s thoughts added, %s replaced\n' % (created, replaced))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            if source is not sys.stdin:
+                source.close()
+            # the rows went in without save(), so nothing derived from them has
+            # caught up yet. That includes the batches committed before a bad line.
+            if created or replaced:
+                ArchiveCount.objects.rebuild()
+                Thought.objects.rebuild_neighbours()
+                search.rebuild()
+                lookup.detail_pks.clear()
+
+    def parse(self, number, line):
+        try:
+            record = json.loads(line)
+        except ValueError, e:
+            raise CommandError('line %s: %s' % (number, e))
+        if not isinstance(record, dict):
+            raise CommandError('line %s: expected a JSON object' % number)
+        missing = [field for field in REQUIRED if field not in record]
+        if missing:
+            raise CommandError('line %s: missing %s' % (number, ', '.join(missing)))
+
+        thought = Thought(title=record['title'], slug=record['slug'], content=record['content'],
+                          published=bool(record.get('published', False)))
+        try:
+            thought.pub_date = Thought._meta.get_field('pub_date').to_python(
+                unicode(record['pub_date']).replace('T', ' '))
+            thought.clean_fields(exclude=['pub_day'])
+        except ValidationError, e:
+            raise CommandError('line %s: %s' % (number, '; '.join(e.messages)))
+        thought.pub_day = thought.pub_date.date()
+        return thought
+
+    def write_batch(self, thoughts, rendered):
+        '''upsert one batch on (pub_day, slug); returns (added, replaced)'''
+        # a later line for the same day and slug wins, as it would have one save at a time
+        by_key = OrderedDict()
+        for thought, html in zip(thoughts, rendered):
+            by_key[thought.pub_day, thought.slug] = (thought, html)
+
+        existing = {}
+        rows = (Thought.objects.filter(pub_day__in=set(day for day, slug in by_key),
+                                       slug__in=set(slug for day, slug in by_key))
+                .values_list('pk', 'pub_day', 'slug', 'published', 'pub_date'))
+        for pk, pub_day, slug, published, pub_date in rows:
+            if (pub_day, slug) in by_key:
+                existing[pub_day, slug] = (pk, published, pub_date)
+
+        now = datetime.datetime.now()
+        new, replaced, scopes = [], [], []
+        for key, (thought, html) in by_key.items():
+            if key in existing:
+                thought.pk, published, pub_date = existing[key]
+                scopes += cache.scopes_for(published, pub_date, thought.slug)
+                replaced.append(thought)
+            else:
+                new.append(thought)
+            thought.modified = now
+            thought.apply_rendered(html)
+            scopes += cache.scopes_for(thought.published, thought.pub_date, thought.slug)
+
+        with transaction.commit_on_success():
+            bulk.insert(new)
+            bulk.update(replaced)
+        cache.bump(scopes)
+        return len(new), len(replaced)
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# run in a fresh interpreter, so nothing this process already imported counts
+PROBE = r'''
+import json, resource, sys, time
+from StringIO import StringIO
+
+start = time.time()
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+imported = time.time()
+
+def request(path):
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': StringIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    body = ''.join(handler(environ, lambda code, headers, exc_info=None: status.append(code)))
+    return int(status[0].split()[0])
+
+def rss_kb():
+    # peak so far; VmHWM because Linux carries ru_maxrss over from the parent
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+status = request(sys.argv[1])
+ready = time.time()
+ready_rss = rss_kb()
+request(sys.argv[1])
+second = time.time()
+
+print json.dumps({
+    'status': status,
+    'import_ms': round((imported - start) * 1000, 1),
+    'first_request_ms': round((ready - imported) * 1000, 1),
+    'ready_ms': round((ready - start) * 1000, 1),
+    'second_request_ms': round((second - ready) * 1000, 1),
+    'rss_kb': ready_rss,
+    'warm_rss_kb': rss_kb(),
+    'modules': len(sys.modules),
+    'loaded': dict((name, name in sys.modules) for name in ('markdown', 'pygments', 'django.contrib.admin')),
+})
+'''
+
+class Command(BaseCommand):
+    help = ('Start fresh interpreters the way a worker starts and report how long it takes to '
+            'import the site and answer its first request, its RSS at that point, and its RSS '
+            'after a second request.')
+    option_list = BaseCommand.option_list + (
+        make_option('--url', dest='url', default='/thoughts/',
+            help='Path to request once the site is loaded.'),
+        make_option('--urlconf', dest='urlconf', default=None,
+            help='ROOT_URLCONF for the workers, e.g. brianhicks.urls_public.'),
+        make_option('--repeat', dest='repeat', type='int', default=5,
+            help='Number of cold starts; the median of each figure is reported.'),
+        make_option('--json', dest='json', action='store_true', default=False,
+            help='Print the results as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path),
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+        if options['urlconf']:
+            env['DJANGO_ROOT_URLCONF'] = options['urlconf']
+
+        runs = []
+        for i in range(options['repeat']):
+            probe = subprocess.Popen([sys.executable, '-c', PROBE, options['url']], env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = probe.communicate()
+            if probe.returncode:
+                raise CommandError('worker failed to start:\n%s' % err)
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+
+        middle = len(runs) // 2
+        result = dict(runs[middle])
+        for key in ('import_ms', 'first_request_ms', 'ready_ms', 'second_request_ms', 'rss_kb', 'warm_rss_kb'):
+            result[key] = sorted(run[key] for run in runs)[middle]
+        result.update(url=options['url'], urlconf=env.get('DJANGO_ROOT_URLCONF', settings.ROOT_URLCONF),
+                      repeat=options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
+            return
+        self.stdout.write('%(urlconf)s, GET %(url)s -> %(status)s (median of %(repeat)s cold starts)\n' % result)
+        self.stdout.write('  import          %8.1f ms\n' % result['import_ms'])
+        self.stdout.write('  first request   %8.1f ms\n' % result['first_request_ms'])
+        self.stdout.write('  ready           %8.1f ms\n' % result['ready_ms'])
+        self.stdout.write('  second request  %8.1f ms\n' % result['second_request_ms'])
+        self.stdout.write('  rss when ready  %8d kB\n' % result['rss_kb'])
+        self.stdout.write('  rss when warm   %8d kB\n' % result['warm_rss_kb'])
+        self.stdout.write('  modules         %8d\n' % result['modules'])
+        for name, loaded in sorted(result['loaded'].items()):
+            self.stdout.write('  %-15s %8s\n' % (name, loaded and 'loaded' or '-'))
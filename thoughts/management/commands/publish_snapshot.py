@@ -0,0 +1,24 @@
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from thoughts import snapshot
+
+class Command(BaseCommand):
+    help = ('Copy the published thoughts into a fresh read-only SQLite snapshot and swap it in '
+            'for the public pages to read from.')
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='File to publish to (defaults to THOUGHTS_SNAPSHOT).'),
+    )
+    
+    def handle(self, *args, **options):
+        output = options['output'] or snapshot.path()
+        if not output:
+            raise CommandError('Set THOUGHTS_SNAPSHOT or give --output.')
+        start = time.time()
+        thoughts = snapshot.publish(output)
+        self.stdout.write('Published %s thoughts to %s (%.1f MB) in %.2fs\n' % (
+            thoughts, output, os.path.getsize(output) / 1048576.0, time.time() - start))
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+
+from thoughts.models import ArchiveCount
+
+class Command(NoArgsCommand):
+    help = 'Recount published thoughts per year, month and day from scratch.'
+    
+    def handle_noargs(self, **options):
+        periods = ArchiveCount.objects.rebuild()
+        self.stdout.write('Rebuilt %s archive periods\n' % periods)
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+
+from thoughts import search
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the full-text search index over published thoughts.'
+    
+    def handle_noargs(self, **options):
+        indexed = search.rebuild()
+        self.stdout.write('Indexed %s thoughts\n' % indexed)
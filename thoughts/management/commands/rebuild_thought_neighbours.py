@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+
+from thoughts.models import Thought
+
+class Command(NoArgsCommand):
+    help = 'Set the previous/next links of every Thought from scratch.'
+    
+    def handle_noargs(self, **options):
+        changed = Thought.objects.rebuild_neighbours()
+        self.stdout.write('Relinked %s thoughts\n' % changed)
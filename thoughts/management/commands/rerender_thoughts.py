@@ -0,0 +1,94 @@
+import datetime
+import os
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from thoughts import cache, rendering
+from thoughts.models import Thought
+
+class Command(BaseCommand):
+    help = 'Re-render html_content (and the columns derived from it) for every Thought, in primary key batches across a process pool.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of thoughts to render and write per transaction.'),
+        make_option('--processes', dest='processes', type='int', default=None,
+            help='Number of render processes (defaults to one per CPU).'),
+        make_option('--checkpoint', dest='checkpoint', default='.rerender_thoughts.checkpoint',
+            help='File recording the last primary key written, for --resume.'),
+        make_option('--resume', dest='resume', action='store_true', default=False,
+            help='Continue after the primary key recorded in the checkpoint file.'),
+        make_option('--dry-run', dest='dry_run', action='store_true', default=False,
+            help='Render everything but write nothing.'),
+        make_option('--changed-only', dest='changed_only', action='store_true', default=False,
+            help='Only update rows whose rendered HTML differs from what is stored.'),
+    )
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        dry_run = options['dry_run']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        
+        last_pk = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            last_pk = int(open(checkpoint).read().strip() or 0)
+            self.stdout.write('Resuming after pk %s\n' % last_pk)
+        
+        # don't hand the parent's database connection to the forked workers
+        connection.close()
+        pool = Pool(options['processes'])
+        
+        seen, updated = 0, 0
+        try:
+            while True:
+                thoughts = list(Thought.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+                if not thoughts:
+                    break
+                
+                rendered = pool.map(rendering.render, [thought.content for thought in thoughts])
+                now = datetime.datetime.now()
+                changes, scopes = [], []
+                for thought, html in zip(thoughts, rendered):
+                    old = [getattr(thought, field) for field in Thought.RENDERED_FIELDS]
+                    thought.apply_rendered(html)
+                    if options['changed_only'] and old == [getattr(thought, field) for field in Thought.RENDERED_FIELDS]:
+                        continue
+                    # feed entries carry the modification time, so render them again with it
+                    thought.modified = now
+                    thought.apply_rendered(html)
+                    changes.append([getattr(thought, field) for field in Thought.RENDERED_FIELDS] + [now, thought.pk])
+                    scopes += cache.scopes_for(thought.published, thought.pub_date, thought.slug)
+                
+                if changes and not dry_run:
+                    self.write_batch(changes)
+                    # the raw UPDATE skips the save signals, so move the cached pages on here
+                    cache.bump(scopes)
+                
+                seen += len(thoughts)
+                updated += len(changes)
+                last_pk = thoughts[-1].pk
+                if not dry_run:
+                    open(checkpoint, 'w').write('%s\n' % last_pk)
+                self.stdout.write('%s thoughts rendered, %s %s (through pk %s)\n' % (
+                    seen, updated, dry_run and 'would change' or 'updated', last_pk))
+        finally:
+            pool.close()
+            pool.join()
+        
+        if not dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+            
+    def write_batch(self, changes):
+        qn = connection.ops.quote_name
+        columns = list(Thought.RENDERED_FIELDS) + ['modified']
+        sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+            qn(Thought._meta.db_table),
+            ', '.join('%s = %%s' % qn(column) for column in columns),
+            qn(Thought._meta.pk.column))
+        with transaction.commit_on_success():
+            connection.cursor().executemany(sql, changes)
+            transaction.set_dirty()
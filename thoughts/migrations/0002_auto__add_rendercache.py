@@ -0,0 +1,49 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'RenderCache'
+        db.create_table('thoughts_rendercache', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('digest', self.gf('django.db.models.fields.CharField')(unique=True, max_length=40)),
+            ('html', self.gf('django.db.models.fields.TextField')()),
+            ('hits', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('last_used', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+        ))
+        db.send_create_signal('thoughts', ['RenderCache'])
+
+
+    def backwards(self, orm):
+        
+        # Deleting model 'RenderCache'
+        db.delete_table('thoughts_rendercache')
+
+
+    models = {
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.thought': {
+            'Meta': {'object_name': 'Thought'},
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
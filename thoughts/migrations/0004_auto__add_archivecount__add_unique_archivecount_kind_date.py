@@ -0,0 +1,61 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'ArchiveCount'
+        db.create_table('thoughts_archivecount', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('kind', self.gf('django.db.models.fields.CharField')(max_length=5)),
+            ('date', self.gf('django.db.models.fields.DateField')()),
+            ('count', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('thoughts', ['ArchiveCount'])
+
+        # Adding unique constraint on 'ArchiveCount', fields ['kind', 'date']
+        db.create_unique('thoughts_archivecount', ['kind', 'date'])
+
+
+    def backwards(self, orm):
+        
+        # Removing unique constraint on 'ArchiveCount', fields ['kind', 'date']
+        db.delete_unique('thoughts_archivecount', ['kind', 'date'])
+
+        # Deleting model 'ArchiveCount'
+        db.delete_table('thoughts_archivecount')
+
+
+    models = {
+        'thoughts.archivecount': {
+            'Meta': {'unique_together': "(('kind', 'date'),)", 'object_name': 'ArchiveCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '5'})
+        },
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.thought': {
+            'Meta': {'object_name': 'Thought'},
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
@@ -0,0 +1,55 @@
+# encoding: utf-8
+import datetime
+from collections import defaultdict
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Count the already published thoughts into the archive summary."
+        counts = defaultdict(int)
+        for pub_date in orm.Thought.objects.filter(published=True).values_list('pub_date', flat=True).iterator():
+            day = pub_date.date()
+            for period in [('year', day.replace(month=1, day=1)), ('month', day.replace(day=1)), ('day', day)]:
+                counts[period] += 1
+        for (kind, date), count in counts.iteritems():
+            orm.ArchiveCount.objects.create(kind=kind, date=date, count=count)
+
+
+    def backwards(self, orm):
+        "Empty the archive summary."
+        orm.ArchiveCount.objects.all().delete()
+
+
+    models = {
+        'thoughts.archivecount': {
+            'Meta': {'unique_together': "(('kind', 'date'),)", 'object_name': 'ArchiveCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '5'})
+        },
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.thought': {
+            'Meta': {'object_name': 'Thought'},
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
+    symmetrical = True
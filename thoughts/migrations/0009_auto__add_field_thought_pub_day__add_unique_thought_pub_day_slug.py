@@ -0,0 +1,71 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+from thoughts import schema
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding field 'Thought.pub_day'
+        db.add_column('thoughts_thought', 'pub_day', self.gf('django.db.models.fields.DateField')(default=datetime.date.today), keep_default=False)
+        schema.restore_indexes(db)
+
+        if not db.dry_run:
+            seen = {}
+            for pk, slug, pub_date in orm.Thought.objects.values_list('pk', 'slug', 'pub_date').iterator():
+                if (pub_date.date(), slug) in seen:
+                    raise ValueError('Thoughts %s and %s are both "%s" on %s; change one slug before migrating.' % (
+                        seen[(pub_date.date(), slug)], pk, slug, pub_date.date()))
+                seen[(pub_date.date(), slug)] = pk
+                orm.Thought.objects.filter(pk=pk).update(pub_day=pub_date.date())
+
+        # Adding unique constraint on 'Thought', fields ['pub_day', 'slug']
+        db.create_unique('thoughts_thought', ['pub_day', 'slug'])
+
+
+    def backwards(self, orm):
+        
+        # Removing unique constraint on 'Thought', fields ['pub_day', 'slug']
+        db.delete_unique('thoughts_thought', ['pub_day', 'slug'])
+
+        # Deleting field 'Thought.pub_day'
+        db.delete_column('thoughts_thought', 'pub_day')
+
+
+    models = {
+        'thoughts.archivecount': {
+            'Meta': {'unique_together': "(('kind', 'date'),)", 'object_name': 'ArchiveCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '5'})
+        },
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.thought': {
+            'Meta': {'unique_together': "(('pub_day', 'slug'),)", 'object_name': 'Thought'},
+            'atom_entry': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'pub_day': ('django.db.models.fields.DateField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'rss_item': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
@@ -0,0 +1,61 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+from thoughts import schema
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # (published, pub_date) becomes (published, pub_date, modified), which
+        # answers the listing validators from the index alone
+        if db.backend_name == 'sqlite3':
+            db.execute('DROP INDEX IF EXISTS %s' % db.quote_name(db.create_index_name('thoughts_thought', ['published', 'pub_date'])))
+            schema.restore_indexes(db)
+        else:
+            db.delete_index('thoughts_thought', ['published', 'pub_date'])
+            db.create_index('thoughts_thought', ['published', 'pub_date', 'modified'])
+
+
+    def backwards(self, orm):
+        
+        db.delete_index('thoughts_thought', ['published', 'pub_date', 'modified'])
+        db.create_index('thoughts_thought', ['published', 'pub_date'])
+
+
+    models = {
+        'thoughts.archivecount': {
+            'Meta': {'unique_together': "(('kind', 'date'),)", 'object_name': 'ArchiveCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '5'})
+        },
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.thought': {
+            'Meta': {'unique_together': "(('pub_day', 'slug'),)", 'object_name': 'Thought'},
+            'atom_entry': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'pub_day': ('django.db.models.fields.DateField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'rss_item': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
@@ -0,0 +1,80 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+from thoughts import schema
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'RenderTask'
+        db.create_table('thoughts_rendertask', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('thought', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['thoughts.Thought'])),
+            ('modified', self.gf('django.db.models.fields.DateTimeField')()),
+            ('claimed', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('attempts', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('error', self.gf('django.db.models.fields.TextField')(blank=True)),
+        ))
+        db.send_create_signal('thoughts', ['RenderTask'])
+
+        # Adding field 'Thought.render_pending'
+        db.add_column('thoughts_thought', 'render_pending', self.gf('django.db.models.fields.BooleanField')(default=False), keep_default=False)
+        schema.restore_indexes(db)
+
+
+    def backwards(self, orm):
+        
+        # Deleting model 'RenderTask'
+        db.delete_table('thoughts_rendertask')
+
+        # Deleting field 'Thought.render_pending'
+        db.delete_column('thoughts_thought', 'render_pending')
+
+
+    models = {
+        'thoughts.archivecount': {
+            'Meta': {'unique_together': "(('kind', 'date'),)", 'object_name': 'ArchiveCount'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '5'})
+        },
+        'thoughts.rendercache': {
+            'Meta': {'object_name': 'RenderCache'},
+            'digest': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'html': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_used': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'})
+        },
+        'thoughts.rendertask': {
+            'Meta': {'object_name': 'RenderTask'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'claimed': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'thought': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['thoughts.Thought']"})
+        },
+        'thoughts.thought': {
+            'Meta': {'unique_together': "(('pub_day', 'slug'),)", 'object_name': 'Thought'},
+            'atom_entry': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'html_content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now', 'db_index': 'True'}),
+            'pub_date': ('django.db.models.fields.DateTimeField', [], {}),
+            'pub_day': ('django.db.models.fields.DateField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'render_pending': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'rss_item': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        }
+    }
+
+    complete_apps = ['thoughts']
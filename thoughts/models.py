@@ -1,13 +1,152 @@
 import datetime
+import math
+from collections import defaultdict
+from HTMLParser import HTMLParser
 
-import markdown
-from django.db import models
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models.signals import post_init, post_save, post_delete
+from django.template.loader import render_to_string
+from django.utils.feedgenerator import get_tag_uri, rfc2822_date, rfc3339_date
+from django.utils.html import strip_tags
+from django.utils.text import truncate_words, truncate_html_words
+
+from thoughts import cache, instrumentation, lookup, rendering, search
 
 # Create your models here.
 
+EXCERPT_WORDS = getattr(settings, 'THOUGHTS_EXCERPT_WORDS', 50)
+WORDS_PER_MINUTE = getattr(settings, 'THOUGHTS_WORDS_PER_MINUTE', 200)
+
+class RenderCacheManager(models.Manager):
+    '''
+    content-addressed cache in front of rendering.render_blocks(). Hit and miss
+    counters are per process; `hits` on each entry is persistent.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(RenderCacheManager, self).__init__(*args, **kwargs)
+        self.hits = 0
+        self.misses = 0
+        
+    def render(self, source):
+        digest = rendering.fingerprint(source)
+        now = datetime.datetime.now()
+        
+        cached = list(self.filter(digest=digest).values_list('html', flat=True)[:1])
+        if cached:
+            self.hits += 1
+            self.filter(digest=digest).update(hits=models.F('hits') + 1, last_used=now)
+            return cached[0]
+            
+        self.misses += 1
+        html = rendering.render_blocks(source)
+        try:
+            self.create(digest=digest, html=html, last_used=now)
+        except IntegrityError:
+            # somebody else rendered the same source in the meantime
+            pass
+        self.evict()
+        return html
+        
+    def evict(self, max_entries=None):
+        '''drop the least recently used entries past the size limit'''
+        if max_entries is None:
+            max_entries = getattr(settings, 'THOUGHTS_RENDER_CACHE_SIZE', 1000)
+        excess = self.count() - max_entries
+        if excess > 0:
+            stale = list(self.order_by('last_used').values_list('pk', flat=True)[:excess])
+            self.filter(pk__in=stale).delete()
+            
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': self.count(),
+        }
+        
+class RenderCache(models.Model):
+    '''
+    rendered HTML for a piece of Markdown, keyed by rendering.fingerprint()
+    '''
+    digest = models.CharField(max_length=40, unique=True)
+    html = models.TextField()
+    
+    hits = models.PositiveIntegerField(default=0)
+    last_used = models.DateTimeField(db_index=True)
+    
+    objects = RenderCacheManager()
+    
+    def __unicode__(self):
+        return self.digest
+
 class ThoughtManager(models.Manager):
     def published(self):
-        return self.filter(published=True).order_by('-pub_date')
+        return self.filter(published=True).order_by('-pub_date', '-id')
+        
+    def published_list(self):
+        '''
+        published thoughts with only the columns the list templates use, so
+        archive pages don't drag the content/html_content text along
+        '''
+        return self.published().only('id', 'title', 'slug', 'published', 'pub_date', 'list_item')
+        
+    def next_scheduled(self):
+        '''pub_date of the next published thought that isn't live yet, or None'''
+        upcoming = self.filter(published=True, pub_date__gt=datetime.datetime.now())
+        return upcoming.aggregate(next=models.Min('pub_date'))['next']
+        
+    def neighbours(self, pub_date, pk):
+        '''
+        primary keys of the published thoughts either side of (pub_date, pk),
+        leaving out pk itself. Each is one step down the (published, pub_date)
+        index.
+        '''
+        published = self.filter(published=True).exclude(pk=pk)
+        before = published.filter(pub_date__lte=pub_date).exclude(pub_date=pub_date, pk__gt=pk)
+        after = published.filter(pub_date__gte=pub_date).exclude(pub_date=pub_date, pk__lt=pk)
+        before = list(before.order_by('-pub_date', '-pk').values_list('pk', flat=True)[:1])
+        after = list(after.order_by('pub_date', 'pk').values_list('pk', flat=True)[:1])
+        return before and before[0] or None, after and after[0] or None
+        
+    def touch(self, pks):
+        '''
+        mark thoughts whose previous/next links changed as modified, so
+        conditional GETs and the response cache notice
+        '''
+        pks = [pk for pk in set(pks) if pk is not None]
+        now = datetime.datetime.now()
+        # a few hundred at a time, to stay under SQLite's limit on query parameters
+        for start in range(0, len(pks), 500):
+            chunk = pks[start:start + 500]
+            self.filter(pk__in=chunk).update(modified=now)
+            cache.bump([cache.thought_scope(pub_date, slug)
+                        for pub_date, slug in self.filter(pk__in=chunk, published=True).values_list('pub_date', 'slug')])
+        
+    def rebuild_neighbours(self):
+        '''
+        set every thought's previous/next links from scratch, for after bulk
+        writes; returns how many thoughts' links changed
+        '''
+        rows = list(self.filter(published=True).order_by('pub_date', 'pk')
+                    .values_list('pk', 'previous_thought', 'next_thought'))
+        pks = [None] + [pk for pk, previous, next in rows] + [None]
+        changes = []
+        for index, (pk, previous, next) in enumerate(rows, 1):
+            if (previous, next) != (pks[index - 1], pks[index + 1]):
+                changes.append([pks[index - 1], pks[index + 1], pk])
+        unpublished = self.filter(published=False).exclude(previous_thought=None, next_thought=None)
+        changes += [[None, None, pk] for pk in unpublished.values_list('pk', flat=True)]
+        
+        qn = connection.ops.quote_name
+        with transaction.commit_on_success():
+            connection.cursor().executemany('UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s' % (
+                qn(self.model._meta.db_table), qn('previous_thought_id'), qn('next_thought_id'), qn('id')), changes)
+            transaction.set_dirty()
+        self.touch([pk for previous, next, pk in changes])
+        return len(changes)
 
 class Thought(models.Model):
     '''
@@ -19,23 +158,321 @@ class Thought(models.Model):
     published = models.BooleanField(default=False)
     
     pub_date = models.DateTimeField()
+    # pub_date's day, denormalized so detail URLs resolve through (pub_day, slug)
+    pub_day = models.DateField(editable=False)
     
     content = models.TextField(help_text="Thought, in Markdown Format")
     html_content = models.TextField(blank=True)
     
+    modified = models.DateTimeField(default=datetime.datetime.now, editable=False, db_index=True)
+    
+    # derived from html_content on save, so list pages never need the body
+    excerpt = models.TextField(blank=True, editable=False)
+    excerpt_html = models.TextField(blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False, help_text='In minutes')
+    # this thought's entry in the list templates, ready to print
+    list_item = models.TextField(blank=True, editable=False)
+    
+    # neighbours in (pub_date, id) order among published thoughts, kept up to
+    # date by the signal handlers below; empty while unpublished
+    previous_thought = models.ForeignKey('self', null=True, blank=True, editable=False, related_name='+', on_delete=models.SET_NULL)
+    next_thought = models.ForeignKey('self', null=True, blank=True, editable=False, related_name='+', on_delete=models.SET_NULL)
+    
+    # feed entries, rendered on save so the feeds only have to concatenate them
+    atom_entry = models.TextField(blank=True, editable=False)
+    rss_item = models.TextField(blank=True, editable=False)
+    
+    # content changed since the rendered columns were last written; see thoughts.tasks
+    render_pending = models.BooleanField(default=False, editable=False)
+    
     objects = ThoughtManager()
     
+    # columns save() derives from content; rerender_thoughts rewrites them in bulk
+    RENDERED_FIELDS = ('html_content', 'excerpt', 'excerpt_html', 'word_count', 'reading_time', 'list_item',
+                       'atom_entry', 'rss_item')
+    
+    # leave rendering to the background render queue instead of doing it in save()
+    async_render = getattr(settings, 'THOUGHTS_ASYNC_RENDER', False)
+    
+    # (published, pub_date, modified) is indexed together by migration 0010;
+    # this version of Django has no way to declare a composite index on the
+    # model itself. See thoughts/schema.py before adding columns.
+    
+    class Meta:
+        unique_together = ('pub_day', 'slug')
+        
+    def clean(self):
+        # pub_day isn't editable, so forms won't check the unique index themselves
+        if self.pub_date and self.slug:
+            clashes = Thought.objects.filter(pub_day=self.pub_date.date(), slug=self.slug).exclude(pk=self.pk)
+            if clashes.exists():
+                raise ValidationError('There is already a thought called "%s" on %s.' % (self.slug, self.pub_date.date()))
+    
     def render_markdown(self, input):
         # turn input into unicode string
         input = unicode(input)
-        return markdown.markdown(input, ['codehilite', 'footnotes'])
+        with instrumentation.timed('markdown'):
+            return RenderCache.objects.render(input)
         
     def save(self, *args, **kwargs):
-        self.html_content = self.render_markdown(self.content)
+        self.modified = datetime.datetime.now()
+        self.pub_day = self.pub_date.date()
+        if self.async_render:
+            # the rendered columns keep their last version until the queue gets here
+            self.render_pending = True
+        else:
+            self.render_pending = False
+            self.apply_rendered(self.render_markdown(self.content))
         super(Thought, self).save(*args, **kwargs)
         
+    def apply_rendered(self, html_content):
+        '''set html_content and every column derived from it (RENDERED_FIELDS)'''
+        self.html_content = html_content
+        self.render_excerpt()
+        self.render_list_item()
+        self.render_feed_entries()
+        
+    def render_excerpt(self):
+        '''set excerpt, excerpt_html, word_count and reading_time from the current html_content'''
+        text = HTMLParser().unescape(strip_tags(self.html_content))
+        self.word_count = len(text.split())
+        self.reading_time = int(math.ceil(self.word_count / float(WORDS_PER_MINUTE)))
+        self.excerpt = truncate_words(text, EXCERPT_WORDS)
+        self.excerpt_html = truncate_html_words(self.html_content, EXCERPT_WORDS)
+        
+    def render_list_item(self):
+        '''render list_item from the title, dates and excerpt'''
+        try:
+            link = self.get_permalink()
+        except NoReverseMatch:
+            self.list_item = ''
+            return
+        self.list_item = render_to_string('thoughts/partials/thought_list_item.html', {'thought': self, 'link': link})
+        
+    def render_feed_entries(self):
+        '''render atom_entry and rss_item from the current html_content'''
+        try:
+            link = 'http://%s%s' % (Site.objects.get_current().domain, self.get_permalink())
+        except NoReverseMatch:
+            # no usable slug yet, so there's nothing a feed could link to
+            self.atom_entry = self.rss_item = ''
+            return
+        except Site.DoesNotExist:
+            # SITE_ID doesn't match a Site; saving shouldn't fail over it.
+            # rerender_thoughts fills these in once it's fixed
+            self.atom_entry = self.rss_item = ''
+            return
+        context = {
+            'thought': self,
+            'link': link,
+            'id': get_tag_uri(link, self.pub_date),
+            'published': rfc3339_date(self.pub_date),
+            'updated': rfc3339_date(self.modified),
+            'pub_date': rfc2822_date(self.pub_date),
+        }
+        self.atom_entry = render_to_string('thoughts/feeds/atom_entry.xml', context)
+        self.rss_item = render_to_string('thoughts/feeds/rss_item.xml', context)
+        
+    def get_permalink(self):
+        return reverse('thought', args=[self.pub_date.year, self.pub_date.strftime('%b'), self.pub_date.strftime('%d'), self.slug])
+        
     def get_absolute_url(self):
         return '%s/%s/%s/%s/' % (self.pub_date.year, self.pub_date.month, self.pub_date.day, self.slug)
         
     def __unicode__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+        
+class RenderTaskManager(models.Manager):
+    def claim(self):
+        '''
+        mark the oldest task nobody is working on as taken and return it, or
+        None when there is nothing to do. Claims older than
+        THOUGHTS_RENDER_CLAIM_TIMEOUT seconds are assumed to belong to a
+        worker that died, and are handed out again.
+        '''
+        now = datetime.datetime.now()
+        expired = now - datetime.timedelta(seconds=getattr(settings, 'THOUGHTS_RENDER_CLAIM_TIMEOUT', 600))
+        waiting = self.filter(attempts__lt=getattr(settings, 'THOUGHTS_RENDER_MAX_ATTEMPTS', 3))
+        waiting = waiting.filter(models.Q(claimed__isnull=True) | models.Q(claimed__lt=expired)).order_by('pk')
+        for task in waiting[:10]:
+            # whoever's UPDATE matches first gets it
+            if self.filter(pk=task.pk, claimed=task.claimed).update(claimed=now):
+                task.claimed = now
+                return task
+        return None
+        
+    def failed(self):
+        return self.filter(attempts__gte=getattr(settings, 'THOUGHTS_RENDER_MAX_ATTEMPTS', 3))
+        
+class RenderTask(models.Model):
+    '''
+    a saved version of a thought whose rendered columns are still to be
+    written. Thought.save() queues one in async_render mode; thoughts.tasks
+    works through them.
+    '''
+    thought = models.ForeignKey(Thought)
+    # Thought.modified of the version that was saved
+    modified = models.DateTimeField()
+    
+    claimed = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    objects = RenderTaskManager()
+    
+    def __unicode__(self):
+        return u'%s at %s' % (self.thought_id, self.modified)
+        
+class ArchiveCountManager(models.Manager):
+    def periods(self, pub_date):
+        '''the (kind, date) buckets a thought published at pub_date counts towards'''
+        day = pub_date.date()
+        return [
+            ('year', day.replace(month=1, day=1)),
+            ('month', day.replace(day=1)),
+            ('day', day),
+        ]
+        
+    def adjust(self, pub_date, delta):
+        for kind, date in self.periods(pub_date):
+            updated = self.filter(kind=kind, date=date).update(count=models.F('count') + delta)
+            if not updated and delta > 0:
+                try:
+                    self.create(kind=kind, date=date, count=delta)
+                except IntegrityError:
+                    self.filter(kind=kind, date=date).update(count=models.F('count') + delta)
+                    
+    def rebuild(self):
+        '''recount everything from the published thoughts'''
+        counts = defaultdict(int)
+        for pub_date in Thought.objects.filter(published=True).values_list('pub_date', flat=True).iterator():
+            for period in self.periods(pub_date):
+                counts[period] += 1
+                
+        self.all().delete()
+        for (kind, date), count in counts.iteritems():
+            self.create(kind=kind, date=date, count=count)
+        return len(counts)
+        
+class ArchiveCount(models.Model):
+    '''
+    number of published thoughts per year, month and day. Kept up to date by
+    the Thought signal handlers below so archive views never have to scan
+    the thoughts table to find out which periods have posts.
+    '''
+    KIND_CHOICES = (
+        ('year', 'Year'),
+        ('month', 'Month'),
+        ('day', 'Day'),
+    )
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    objects = ArchiveCountManager()
+    
+    class Meta:
+        unique_together = ('kind', 'date')
+        
+    def __unicode__(self):
+        return u'%s %s: %s' % (self.kind, self.date, self.count)
+        
+# signals
+
+def remember_saved_state(sender, instance, **kwargs):
+    '''what the row looked like when loaded, so post_save can tell what moved'''
+    instance._saved_state = (instance.published, instance.pub_date, instance.slug, instance.title)
+    
+def update_archive_counts(sender, instance, created, **kwargs):
+    was_published, old_date, old_slug, old_title = getattr(instance, '_saved_state', (False, None, None, None))
+    if created:
+        was_published = False
+    
+    if (was_published, old_date) != (instance.published, instance.pub_date):
+        if was_published and old_date:
+            ArchiveCount.objects.adjust(old_date, -1)
+        if instance.published:
+            ArchiveCount.objects.adjust(instance.pub_date, 1)
+            
+def remove_archive_counts(sender, instance, **kwargs):
+    was_published, old_date, old_slug, old_title = getattr(instance, '_saved_state', (False, None, None, None))
+    if was_published and old_date:
+        ArchiveCount.objects.adjust(old_date, -1)
+        
+def invalidate_cached_responses(sender, instance, **kwargs):
+    was_published, old_date, old_slug, old_title = getattr(instance, '_saved_state', (False, None, None, None))
+    if kwargs.get('created'):
+        was_published = False
+    scopes = cache.scopes_for(was_published, old_date, old_slug)
+    if kwargs.get('signal') is not post_delete:
+        scopes += cache.scopes_for(instance.published, instance.pub_date, instance.slug)
+    cache.bump(scopes)
+    
+def queue_render(sender, instance, **kwargs):
+    if instance.render_pending and instance.async_render:
+        RenderTask.objects.create(thought=instance, modified=instance.modified)
+        # imported here because thoughts.tasks needs these models
+        from thoughts import tasks
+        tasks.wake()
+        
+def update_neighbours(sender, instance, **kwargs):
+    '''
+    unlink the thought from where it was in the published order, link it in
+    where it is now, and touch every neighbour whose links show something
+    different as a result
+    '''
+    was_published, old_date, old_slug, old_title = getattr(instance, '_saved_state', (False, None, None, None))
+    if kwargs.get('created'):
+        was_published = False
+    deleted = kwargs.get('signal') is post_delete
+    published = instance.published and not deleted
+    if not (was_published or published):
+        return
+    
+    def link(previous, next):
+        if previous:
+            Thought.objects.filter(pk=previous).update(next_thought=next)
+        if next:
+            Thought.objects.filter(pk=next).update(previous_thought=previous)
+            
+    old = new = (None, None)
+    if was_published and old_date:
+        old = Thought.objects.neighbours(old_date, instance.pk)
+        link(*old)
+    if published:
+        new = Thought.objects.neighbours(instance.pub_date, instance.pk)
+        link(new[0], instance.pk)
+        link(instance.pk, new[1])
+    if not deleted:
+        # the row save() wrote may have had links that were already out of date
+        Thought.objects.filter(pk=instance.pk).update(previous_thought=new[0], next_thought=new[1])
+        instance.previous_thought_id, instance.next_thought_id = new
+        
+    if (was_published, old_date, old_slug, old_title) != (published, instance.pub_date, instance.slug, instance.title):
+        Thought.objects.touch(old + new)
+    else:
+        Thought.objects.touch(set(old) ^ set(new))
+        
+def forget_detail_lookup(sender, instance, **kwargs):
+    lookup.detail_pks.discard_value(instance.pk)
+    
+def update_search_index(sender, instance, **kwargs):
+    search.index(instance)
+    
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex(instance)
+    
+post_init.connect(remember_saved_state, sender=Thought)
+post_save.connect(update_archive_counts, sender=Thought)
+post_save.connect(invalidate_cached_responses, sender=Thought)
+post_save.connect(update_search_index, sender=Thought)
+post_save.connect(forget_detail_lookup, sender=Thought)
+post_save.connect(queue_render, sender=Thought)
+post_save.connect(update_neighbours, sender=Thought)
+post_save.connect(remember_saved_state, sender=Thought)
+post_delete.connect(remove_archive_counts, sender=Thought)
+post_delete.connect(invalidate_cached_responses, sender=Thought)
+post_delete.connect(remove_from_search_index, sender=Thought)
+post_delete.connect(forget_detail_lookup, sender=Thought)
+post_delete.connect(update_neighbours, sender=Thought)
@@ -0,0 +1,92 @@
+'''
+keyset ("seek") pagination over (pub_date, id), newest first.
+
+Instead of a page number, pages are addressed by an opaque cursor naming the
+last thought seen, so every page costs one indexed range scan no matter how
+deep it is and nothing has to COUNT(*) the whole table.
+'''
+import base64
+import binascii
+import datetime
+
+CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(thought):
+    raw = '%s|%s' % (thought.pub_date.strftime(CURSOR_FORMAT), thought.pk)
+    return base64.urlsafe_b64encode(raw).rstrip('=')
+
+def decode_cursor(token):
+    try:
+        token = str(token)
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        stamp, pk = raw.split('|')
+        return datetime.datetime.strptime(stamp, CURSOR_FORMAT), int(pk)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor('Invalid cursor %r' % token)
+
+class CursorPaginator(object):
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        
+    def page(self, after=None, before=None):
+        '''
+        the page of objects older than the `after` cursor, newer than the
+        `before` cursor, or the first page if neither is given.
+        '''
+        qs = self.object_list
+        if before:
+            pub_date, pk = decode_cursor(before)
+            qs = qs.filter(pub_date__gte=pub_date).exclude(pub_date=pub_date, pk__lte=pk)
+            rows = list(qs.order_by('pub_date', 'pk')[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, has_previous=more, has_next=True)
+            
+        if after:
+            pub_date, pk = decode_cursor(after)
+            qs = qs.filter(pub_date__lte=pub_date).exclude(pub_date=pub_date, pk__gte=pk)
+        rows = list(qs.order_by('-pub_date', '-pk')[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, has_previous=bool(after), has_next=more)
+        
+class CursorPage(object):
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+        
+    def __repr__(self):
+        return '<Cursor page of %s>' % len(self.object_list)
+        
+    def __len__(self):
+        return len(self.object_list)
+        
+    def __iter__(self):
+        return iter(self.object_list)
+        
+    def __getitem__(self, index):
+        return self.object_list[index]
+        
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+        
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+        
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+        
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(self.object_list[-1])
+        
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(self.object_list[0])
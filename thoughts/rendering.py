@@ -0,0 +1,48 @@
+'''
+Markdown rendering for thoughts.
+
+markdown and pygments (and thoughts.highlight, which needs both) are only
+imported when something is actually rendered. Pages are served from the HTML
+stored on each thought, so a worker that only serves them never loads either.
+'''
+import hashlib
+
+# markdown extensions used for every thought. codehilite is swapped for
+# thoughts.highlight, which gives the same output with its blocks cached.
+EXTENSIONS = ['codehilite', 'footnotes']
+
+def extensions():
+    from thoughts import highlight
+    return [name == 'codehilite' and highlight.makeExtension() or name for name in EXTENSIONS]
+
+def render(source):
+    '''
+    render Markdown source to HTML. This is the expensive part (pygments runs
+    here), so callers should usually go through the render cache instead.
+    '''
+    import markdown
+    return markdown.Markdown(extensions=extensions()).convert(unicode(source))
+
+def render_blocks(source):
+    '''
+    the same HTML as render(), re-rendering only the blocks that haven't been
+    rendered before (see thoughts.incremental)
+    '''
+    from thoughts import incremental
+    return incremental.render(source)
+
+def versions():
+    import markdown
+    import pygments
+    return 'markdown=%s;pygments=%s;extensions=%s\n' % (markdown.version, pygments.__version__, ','.join(EXTENSIONS))
+
+def fingerprint(source):
+    '''
+    content address for a piece of Markdown source. Anything that can change
+    the output (the extension list and the markdown/pygments versions) is part
+    of the key, so upgrading either one invalidates old entries.
+    '''
+    digest = hashlib.sha1()
+    digest.update(versions())
+    digest.update(unicode(source).encode('utf-8'))
+    return digest.hexdigest()
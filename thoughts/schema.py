@@ -0,0 +1,26 @@
+'''
+indexes on thoughts_thought that South's SQLite backend loses.
+
+South adds a column on SQLite by copying the table, and the copy only keeps
+multi-column unique indexes. Every migration that adds a column to
+thoughts_thought calls restore_indexes() afterwards so the archive, feed and
+sitemap queries don't quietly turn into table scans.
+'''
+TABLE = 'thoughts_thought'
+
+INDEXES = (
+    ('slug',),
+    ('modified',),
+    # covers the published listings and, with modified, the count/last
+    # modified validators without touching the table itself
+    ('published', 'pub_date', 'modified'),
+)
+
+def restore_indexes(db):
+    if db.backend_name != 'sqlite3':
+        return
+    for columns in INDEXES:
+        db.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+            db.quote_name(db.create_index_name(TABLE, columns)),
+            db.quote_name(TABLE),
+            ', '.join(db.quote_name(column) for column in columns)))
@@ -0,0 +1,137 @@
+'''
+full-text search over published thoughts, backed by an SQLite FTS4 table.
+
+thoughts_thought_fts holds the title and Markdown source of every published
+thought, with the thought's id as its docid. The Thought signal handlers in
+models.py keep it in sync; rebuild() fills it from scratch.
+'''
+import datetime
+import re
+import struct
+
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.utils.html import escape
+
+from thoughts import snapshot
+
+FTS_TABLE = 'thoughts_thought_fts'
+
+# how much a hit in each FTS column counts towards the rank: title, content
+WEIGHTS = (2.0, 1.0)
+
+HIGHLIGHT_START, HIGHLIGHT_END = u'\x02', u'\x03'
+
+def available():
+    return connection.vendor == 'sqlite'
+
+def rank(matchinfo):
+    '''
+    relevance from FTS4 matchinfo(..., 'pcx'): for each phrase and column,
+    the share of all that phrase's hits which land in this row, weighted by
+    column.
+    '''
+    info = struct.unpack('@%dI' % (len(matchinfo) // 4), str(matchinfo))
+    phrases, columns = info[0], info[1]
+    score = 0.0
+    for phrase in range(phrases):
+        for column in range(columns):
+            hits_here, hits_everywhere = info[2 + 3 * (phrase * columns + column):][:2]
+            if hits_here:
+                score += WEIGHTS[column] * hits_here / hits_everywhere
+    return score
+
+def register_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('thoughts_rank', 1, rank)
+
+connection_created.connect(register_functions)
+
+def match_expression(query):
+    '''
+    turn free text into a MATCH expression that can't be malformed: every
+    word becomes a quoted term, and FTS ANDs them together
+    '''
+    return u' '.join(u'"%s"' % word for word in re.findall(r'\w+', query, re.UNICODE))
+
+def index(thought):
+    if not available():
+        return
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE docid = %%s' % FTS_TABLE, [thought.pk])
+    if thought.published:
+        cursor.execute('INSERT INTO %s (docid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                       [thought.pk, thought.title, thought.content])
+    transaction.commit_unless_managed()
+
+def unindex(thought):
+    if not available():
+        return
+    connection.cursor().execute('DELETE FROM %s WHERE docid = %%s' % FTS_TABLE, [thought.pk])
+    transaction.commit_unless_managed()
+
+def rebuild():
+    '''reindex every published thought in one pass; returns the number indexed'''
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s' % FTS_TABLE)
+    cursor.execute('INSERT INTO %s (docid, title, content) '
+                   'SELECT id, title, content FROM thoughts_thought WHERE published' % FTS_TABLE)
+    cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+    transaction.commit_unless_managed()
+    cursor.execute('SELECT count(*) FROM %s' % FTS_TABLE)
+    return cursor.fetchone()[0]
+
+class SearchResults(object):
+    '''
+    lazy, sliceable search results in rank order, so a Paginator only ever
+    asks the database for a count and the one page it shows. Each thought
+    comes back with a highlighted `snippet`.
+    '''
+    def __init__(self, query):
+        self.match = match_expression(query)
+        self.now = datetime.datetime.now()
+        self._count = None
+
+    def where(self):
+        return ('FROM %s JOIN thoughts_thought ON thoughts_thought.id = %s.docid '
+                'WHERE %s MATCH %%s AND thoughts_thought.pub_date <= %%s' % (FTS_TABLE, FTS_TABLE, FTS_TABLE))
+
+    def count(self):
+        if self._count is None:
+            if not self.match:
+                self._count = 0
+            else:
+                cursor = snapshot.read_connection().cursor()
+                cursor.execute('SELECT count(*) ' + self.where(), [self.match, self.now])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if not self.match or (stop is not None and stop <= start):
+            return []
+
+        cursor = snapshot.read_connection().cursor()
+        cursor.execute(
+            "SELECT docid, snippet(%s, %%s, %%s, '...', -1, 32) %s "
+            "ORDER BY thoughts_rank(matchinfo(%s, 'pcx')) DESC, thoughts_thought.pub_date DESC "
+            "LIMIT %%s OFFSET %%s" % (FTS_TABLE, self.where(), FTS_TABLE),
+            [HIGHLIGHT_START, HIGHLIGHT_END, self.match, self.now, stop is None and -1 or stop - start, start])
+        rows = cursor.fetchall()
+
+        from thoughts.models import Thought
+        thoughts = Thought.objects.published_list().in_bulk([pk for pk, snippet in rows])
+        results = []
+        for pk, snippet in rows:
+            # a stale index entry, or a thought deleted since the search ran
+            if pk not in thoughts:
+                continue
+            thought = thoughts[pk]
+            thought.snippet = escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+            results.append(thought)
+        return results
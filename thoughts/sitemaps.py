@@ -0,0 +1,166 @@
+'''
+sitemaps of every published thought and archive page.
+
+While everything fits in one sitemap (the protocol allows 50,000 URLs) the
+sitemap is a single urlset. Past that it becomes a sitemap index pointing at
+an archives sitemap and one sitemap per 50,000-wide primary key range, so a
+new thought only ever changes the last shard.
+
+Each sitemap is streamed a primary key batch at a time. The output is
+also compressed into the cache as it goes, under a key made from the count
+and newest modification time of what it lists, so a crawler fetching an
+unchanged shard again costs one aggregate query.
+'''
+import datetime
+import hashlib
+import zlib
+from calendar import timegm
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db.models import Count, Max
+from django.http import HttpResponse, Http404
+from django.utils.html import escape
+from django.utils.http import http_date
+
+from thoughts import snapshot
+from thoughts.models import ArchiveCount, Thought
+
+# URLs per sitemap, the protocol's limit
+LIMIT = 50000
+
+# thoughts per query while streaming. QuerySet.iterator() won't do: SQLite
+# can't read through a cursor in chunks, so it would fetch a whole shard
+BATCH_SIZE = 1000
+
+SITEMAP_KEY = 'thoughts:sitemap:%s'
+TIMEOUT = getattr(settings, 'THOUGHTS_SITEMAP_TIMEOUT', 60 * 60 * 24)
+
+URLSET_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_FOOTER = '</urlset>\n'
+INDEX_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+INDEX_FOOTER = '</sitemapindex>\n'
+
+def visible_thoughts():
+    return Thought.objects.filter(published=True, pub_date__lte=datetime.datetime.now())
+
+def shard_thoughts(number):
+    return visible_thoughts().filter(pk__range=(number * LIMIT + 1, (number + 1) * LIMIT))
+
+def signature(thoughts):
+    '''(count, newest modification) of a queryset; changes whenever its sitemap would'''
+    found = thoughts.aggregate(count=Count('id'), modified=Max('modified'))
+    return found['count'], found['modified']
+
+def lastmod(when):
+    return when.strftime('%Y-%m-%d')
+
+def url_entry(location, modified=None):
+    entry = '<url><loc>%s</loc>' % escape(location)
+    if modified:
+        entry += '<lastmod>%s</lastmod>' % lastmod(modified)
+    return (entry + '</url>\n').encode('utf-8')
+
+def sitemap_entry(location, modified=None):
+    entry = '<sitemap><loc>%s</loc>' % escape(location)
+    if modified:
+        entry += '<lastmod>%s</lastmod>' % lastmod(modified)
+    return (entry + '</sitemap>\n').encode('utf-8')
+
+def thought_entries(root, thoughts):
+    last_pk = 0
+    while True:
+        rows = list(thoughts.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'slug', 'pub_date', 'modified')[:BATCH_SIZE])
+        if not rows:
+            return
+        for pk, slug, pub_date, modified in rows:
+            path = reverse('thought', args=[pub_date.year, pub_date.strftime('%b'), pub_date.strftime('%d'), slug])
+            yield url_entry(root + path, modified)
+        last_pk = rows[-1][0]
+
+def archive_entries(root):
+    yield url_entry(root + reverse('thoughts'))
+    periods = ArchiveCount.objects.filter(count__gt=0, date__lte=datetime.date.today()).order_by('kind', 'date')
+    for kind, date in periods.values_list('kind', 'date').iterator():
+        if kind == 'year':
+            path = reverse('thoughts_year', args=[date.year])
+        elif kind == 'month':
+            path = reverse('thoughts_month', args=[date.year, date.strftime('%b')])
+        else:
+            path = reverse('thoughts_day', args=[date.year, date.strftime('%b'), date.strftime('%d')])
+        yield url_entry(root + path)
+
+def cached(name, validator, chunks):
+    '''
+    the cached body for (name, validator) if there is one, otherwise `chunks`
+    streamed through while a compressed copy is built up for the cache
+    '''
+    key = SITEMAP_KEY % hashlib.md5(u'%s|%s|%s' % (Site.objects.get_current().domain, name, validator)).hexdigest()
+    body = cache.get(key)
+    if body is not None:
+        return [zlib.decompress(body)]
+
+    def stream():
+        compressor = zlib.compressobj()
+        parts = []
+        for chunk in chunks:
+            parts.append(compressor.compress(chunk))
+            yield chunk
+        parts.append(compressor.flush())
+        cache.set(key, ''.join(parts), TIMEOUT)
+    return stream()
+
+def respond(body, modified):
+    response = HttpResponse(body, content_type='application/xml; charset=utf-8')
+    if modified:
+        response['Last-Modified'] = http_date(timegm(modified.utctimetuple()))
+    return response
+
+def shard_lastmods():
+    '''{shard number: newest modification} for every non-empty shard, in one pass'''
+    connection = snapshot.read_connection()
+    cursor = connection.cursor()
+    cursor.execute('SELECT (id - 1) / %%s, max(modified) FROM %s WHERE published AND pub_date <= %%s GROUP BY 1'
+                   % connection.ops.quote_name(Thought._meta.db_table), [LIMIT, datetime.datetime.now()])
+    field = Thought._meta.get_field('modified')
+    return dict((int(number), field.to_python(modified)) for number, modified in cursor.fetchall())
+
+def root_url():
+    return 'http://%s' % Site.objects.get_current().domain
+
+def chain(*parts):
+    for part in parts:
+        for chunk in part:
+            yield chunk
+
+def sitemap(request):
+    root = root_url()
+    count, modified = signature(visible_thoughts())
+    archives = ArchiveCount.objects.filter(count__gt=0, date__lte=datetime.date.today()).count() + 1
+
+    if count + archives <= LIMIT:
+        body = chain([URLSET_HEADER], archive_entries(root), thought_entries(root, visible_thoughts()), [URLSET_FOOTER])
+        return respond(cached('urlset', (count, modified, archives), body), modified)
+
+    def index():
+        yield INDEX_HEADER
+        yield sitemap_entry(root + reverse('thoughts_sitemap_archives'), modified)
+        for number, shard_modified in sorted(shard_lastmods().items()):
+            yield sitemap_entry(root + reverse('thoughts_sitemap_shard', args=[number]), shard_modified)
+        yield INDEX_FOOTER
+    return respond(cached('index', (count, modified), index()), modified)
+
+def sitemap_archives(request):
+    count, modified = signature(visible_thoughts())
+    body = chain([URLSET_HEADER], archive_entries(root_url()), [URLSET_FOOTER])
+    return respond(cached('archives', (count, modified), body), modified)
+
+def sitemap_shard(request, number):
+    number = int(number)
+    count, modified = signature(shard_thoughts(number))
+    if not count:
+        raise Http404
+    body = chain([URLSET_HEADER], thought_entries(root_url(), shard_thoughts(number)), [URLSET_FOOTER])
+    return respond(cached('shard-%s' % number, (count, modified), body), modified)
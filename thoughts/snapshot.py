@@ -0,0 +1,185 @@
+'''
+a read-only SQLite copy of everything the public pages read.
+
+publish() copies the published thoughts (with all their precomputed columns),
+the archive counts and the search index into a fresh, compact SQLite file
+with the indexes the views use, and renames it over the database configured
+as DATABASES['snapshot']. The rename is atomic: requests already running
+keep reading the old file, new ones open the new one.
+
+SnapshotMiddleware marks public GET requests, and while it's set
+SnapshotRouter sends their Thought and ArchiveCount reads to the snapshot.
+Everything else (the admin, the render cache, management commands) stays
+on the primary database, so readers never wait on writers. Snapshot
+connections are opened with PRAGMA query_only and memory-mapped I/O.
+
+The snapshot only changes when something publishes it, e.g. the
+publish_snapshot command after an admin session or from cron. Without a
+snapshot alias (settings.py adds one when THOUGHTS_SNAPSHOT names the file),
+or before the first publish, everything reads the primary.
+'''
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.core.signals import request_finished
+
+ALIAS = 'snapshot'
+
+# what the public views read, as (app label, model name)
+MODELS = (('thoughts', 'Thought'), ('thoughts', 'ArchiveCount'))
+
+# requests under these paths always read the primary
+EXCLUDED_PATHS = getattr(settings, 'THOUGHTS_SNAPSHOT_EXCLUDED_PATHS', ('/admin/',))
+
+MMAP_SIZE = getattr(settings, 'THOUGHTS_SNAPSHOT_MMAP_SIZE', 256 * 1024 * 1024)
+
+# rows per INSERT batch while publishing
+BATCH_SIZE = 1000
+
+# the database alias this thread's request reads from, if not the primary
+serving = threading.local()
+
+class SnapshotRouter(object):
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label, model._meta.object_name) in MODELS:
+            return getattr(serving, 'alias', None)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # including rows that were read from the snapshot
+        return DEFAULT_DB_ALIAS
+
+    def allow_syncdb(self, db, model):
+        if db == ALIAS:
+            return False
+        return None
+
+# DATABASE_ROUTERS are imported while django.db itself is, so SnapshotRouter
+# has to exist before this module imports django.db (if it's the first to),
+# and the models are only imported in publish()
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+
+def path():
+    return connections.databases.get(ALIAS, {}).get('NAME')
+
+def available():
+    return bool(path()) and os.path.exists(path())
+
+def cache_scopes():
+    '''
+    extra response cache scope for pages read from the snapshot; publish()
+    bumps it, so pages cached from an older snapshot aren't served again
+    '''
+    return getattr(serving, 'alias', None) and ['snapshot'] or []
+
+class SnapshotMiddleware(object):
+    def process_request(self, request):
+        public = request.method in ('GET', 'HEAD') and not request.path_info.startswith(EXCLUDED_PATHS)
+        serving.alias = public and available() and ALIAS or None
+
+def finished(sender, **kwargs):
+    # not in process_response: feeds and sitemaps are streamed after it runs
+    serving.alias = None
+
+request_finished.connect(finished)
+
+def configure(sender, connection, **kwargs):
+    if connection.alias == ALIAS:
+        cursor = connection.connection.cursor()
+        cursor.execute('PRAGMA query_only = 1')
+        cursor.execute('PRAGMA mmap_size = %d' % MMAP_SIZE)
+
+connection_created.connect(configure)
+
+def backend():
+    '''the snapshot's connection, for its SQL dialect; the primary's before there is one'''
+    return connections[ALIAS in connections.databases and ALIAS or DEFAULT_DB_ALIAS]
+
+def read_connection():
+    '''the connection raw SQL against thoughts should use for reads'''
+    return connections[getattr(serving, 'alias', None) or DEFAULT_DB_ALIAS]
+
+def copy(target, queryset):
+    '''insert every row of `queryset` into the same table in `target`; returns how many'''
+    quote = backend().ops.quote_name
+    meta = queryset.model._meta
+    fields = meta.local_fields
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (quote(meta.db_table),
+        ', '.join(quote(field.column) for field in fields), ', '.join(['?'] * len(fields)))
+    names = [field.name for field in fields]
+    position = fields.index(meta.pk)
+    # primary key batches: SQLite can't read through a cursor in chunks, so
+    # iterator() would fetch the whole table first
+    count, rows = 0, queryset.order_by('pk')
+    while True:
+        batch = list(rows.values_list(*names)[:BATCH_SIZE])
+        if not batch:
+            return count
+        target.executemany(sql, batch)
+        count += len(batch)
+        rows = queryset.filter(pk__gt=batch[-1][position]).order_by('pk')
+
+def publish(destination=None):
+    '''
+    build a new snapshot next to `destination` (the snapshot alias's file by
+    default) and swap it in; returns the number of thoughts it holds
+    '''
+    from django.core.management.color import no_style
+    from thoughts import cache, schema, search
+    from thoughts.models import ArchiveCount, Thought
+    
+    destination = destination or path()
+    if not destination:
+        raise ValueError('No DATABASES[%r] to publish to' % ALIAS)
+    building = '%s.%s.tmp' % (destination, os.getpid())
+    if os.path.exists(building):
+        os.remove(building)
+
+    # the SQL comes from the snapshot's backend, so it matches what the ORM expects
+    creation = backend().creation
+    quote = backend().ops.quote_name
+    target = sqlite3.connect(building, isolation_level=None)
+    try:
+        target.execute('PRAGMA journal_mode = OFF')
+        target.execute('PRAGMA synchronous = OFF')
+        target.execute('BEGIN')
+        for model in Thought, ArchiveCount:
+            statements, pending = creation.sql_create_model(model, no_style(), set([Thought, ArchiveCount]))
+            for statement in statements:
+                target.execute(statement)
+
+        thoughts = copy(target, Thought.objects.using(DEFAULT_DB_ALIAS).filter(published=True))
+        copy(target, ArchiveCount.objects.using(DEFAULT_DB_ALIAS))
+
+        target.execute('CREATE VIRTUAL TABLE %s USING fts4(title, content)' % search.FTS_TABLE)
+        target.execute('INSERT INTO %s (docid, title, content) SELECT id, title, content FROM %s'
+                       % (search.FTS_TABLE, quote(Thought._meta.db_table)))
+        target.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (search.FTS_TABLE, search.FTS_TABLE))
+
+        # indexes after the rows, so each is built in one sorted pass
+        for model in Thought, ArchiveCount:
+            for statement in creation.sql_indexes_for_model(model, no_style()):
+                target.execute(statement)
+        # the composite ones, which the model can't declare
+        for columns in [columns for columns in schema.INDEXES if len(columns) > 1]:
+            target.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                quote('%s_%s' % (schema.TABLE, '_'.join(columns))), quote(schema.TABLE),
+                ', '.join(quote(column) for column in columns)))
+        target.execute('COMMIT')
+        target.execute('ANALYZE')
+        target.execute('PRAGMA journal_mode = DELETE')
+    except:
+        target.close()
+        os.remove(building)
+        raise
+    target.close()
+
+    os.rename(building, destination)
+    if ALIAS in connections.databases:
+        # this process's own connection would go on reading the replaced file
+        connections[ALIAS].close()
+    cache.bump(['snapshot'])
+    return thoughts
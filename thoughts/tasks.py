@@ -0,0 +1,120 @@
+'''
+background rendering for thoughts saved in async_render mode.
+
+With THOUGHTS_ASYNC_RENDER on, Thought.save() stores the new source, marks
+the thought render_pending and queues a RenderTask instead of running
+Markdown itself. THOUGHTS_RENDER_WORKERS threads in the saving process pick
+tasks up, render the thought and write its rendered columns back. They are
+woken as soon as something is queued and also poll every
+THOUGHTS_RENDER_POLL_INTERVAL seconds, which catches tasks whose
+transaction hadn't committed yet when they were woken.
+
+The queue lives in the database, so nothing is lost when a process exits
+with work outstanding: the drain_render_queue command (or any other
+process's workers) finishes it. Until then the detail view renders pending
+thoughts on demand.
+'''
+import datetime
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connection
+
+from thoughts import cache
+from thoughts.models import RenderTask, Thought
+
+logger = logging.getLogger('thoughts.tasks')
+
+# set to 0 to leave the queue to drain_render_queue
+workers = getattr(settings, 'THOUGHTS_RENDER_WORKERS', 2)
+poll_interval = getattr(settings, 'THOUGHTS_RENDER_POLL_INTERVAL', 5)
+
+def render(task):
+    '''
+    render the current version of the task's thought and write it back.
+    Returns False when the thought changed in the meantime: if it was saved
+    again, that save queued a task of its own and this one is dropped;
+    otherwise (a neighbour moved, say) the task goes back on the queue.
+    '''
+    try:
+        thought = Thought.objects.get(pk=task.thought_id)
+    except Thought.DoesNotExist:
+        task.delete()
+        return False
+
+    saved = thought.modified
+    html = thought.render_markdown(thought.content)
+    # the page changes, so conditional GETs and feed entries have to see a new time
+    thought.modified = datetime.datetime.now()
+    thought.apply_rendered(html)
+
+    columns = dict((field, getattr(thought, field)) for field in Thought.RENDERED_FIELDS)
+    columns.update(modified=thought.modified, render_pending=False)
+    if not Thought.objects.filter(pk=thought.pk, modified=saved).update(**columns):
+        if RenderTask.objects.filter(thought=thought.pk, modified__gt=saved).exists():
+            task.delete()
+        else:
+            RenderTask.objects.filter(pk=task.pk).update(claimed=None)
+        return False
+
+    # every version up to the one just rendered is done
+    RenderTask.objects.filter(thought=thought.pk, modified__lte=saved).delete()
+    cache.bump(cache.scopes_for(thought.published, thought.pub_date, thought.slug))
+    return True
+
+def process():
+    '''claim and render one task; returns it, or None if the queue is empty'''
+    task = RenderTask.objects.claim()
+    if task is None:
+        return None
+    try:
+        render(task)
+    except Exception:
+        logger.exception('rendering thought %s failed', task.thought_id)
+        RenderTask.objects.filter(pk=task.pk).update(
+            claimed=None, attempts=task.attempts + 1, error=traceback.format_exc())
+    return task
+
+def drain(limit=None):
+    '''process tasks until the queue is empty (or `limit` have run); returns how many ran'''
+    done = 0
+    while limit is None or done < limit:
+        if process() is None:
+            break
+        done += 1
+    return done
+
+class Worker(threading.Thread):
+    def __init__(self):
+        super(Worker, self).__init__(name='thoughts render worker')
+        self.daemon = True
+
+    def run(self):
+        while True:
+            wanted.wait(poll_interval)
+            wanted.clear()
+            try:
+                drain()
+            except Exception:
+                logger.exception('render worker failed')
+            finally:
+                # each thread has its own connection; don't hold it between rounds
+                connection.close()
+
+wanted = threading.Event()
+started = []
+lock = threading.Lock()
+
+def start():
+    '''start this process's workers, once'''
+    with lock:
+        while len(started) < workers:
+            worker = Worker()
+            worker.start()
+            started.append(worker)
+
+def wake():
+    start()
+    wanted.set()
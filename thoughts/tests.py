@@ -1,10 +1,37 @@
 from datetime import datetime, timedelta
+import os
+from random import Random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import markdown
 
 from django.test import TestCase, Client
+from django.test.client import RequestFactory
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse
+from django.db import connection, connections, router, DatabaseError, IntegrityError
+from django.http import HttpResponse
+from django.template.response import TemplateResponse
 
-from thoughts.models import Thought
+from thoughts import benchmark, cache as thought_cache, highlight, incremental, instrumentation, lookup, rendering, schema, search, sitemaps, snapshot, tasks, urls as thought_urls
+from thoughts.management.commands import import_thoughts
+from thoughts.models import Thought, RenderCache, RenderTask, ArchiveCount
+from thoughts.pagination import CursorPaginator, InvalidCursor
+from thoughts.views import ResponseCacheMixin, ThoughtDetailView, ThoughtsIndexView
 
 from thoughts.test_helpers import ArchiveCommon, ViewCommon
 
@@ -103,14 +130,53 @@ class ThoughtTest(TestCase):
         self.assertEqual(self.valid_t.html_content, "<p>A <em>test</em> string</p>")
         
         
+class ExcerptTest(TestCase):
+    def setUp(self):
+        self.when = datetime(2011, 2, 3, 12, 0)
+        words = ' '.join('word%s' % i for i in range(450))
+        self.thought = Thought.objects.create(title='Long & short', slug='long', pub_date=self.when, published=True,
+                                              content='Some *emphasis* &amp; more\n\n' + words)
+        
+    def test_excerpt_columns(self):
+        self.assertEqual(self.thought.word_count, 454)
+        self.assertEqual(self.thought.reading_time, 3)
+        self.assertTrue(self.thought.excerpt.startswith(u'Some emphasis & more word0 '))
+        self.assertTrue(self.thought.excerpt.endswith(u'word45 ...'))
+        self.assertTrue(self.thought.excerpt_html.startswith('<p>Some <em>emphasis</em> &amp; more</p>'))
+        self.assertTrue(self.thought.excerpt_html.endswith(' ...</p>'))
+        self.assertNotIn('word50', self.thought.excerpt_html)
+        
+    def test_list_item(self):
+        self.assertIn('<a href="%s">Long &amp; short</a>' % self.thought.get_permalink(), self.thought.list_item)
+        self.assertIn('3 min read', self.thought.list_item)
+        self.assertIn(self.thought.excerpt_html, self.thought.list_item)
+        
+    def test_list_pages_print_stored_fragments(self):
+        response = self.client.get(reverse('thoughts'))
+        self.assertIn(self.thought.list_item, response.content)
+        self.assertNotIn('word449', response.content)
+        
+    def test_backfill(self):
+        Thought.objects.update(excerpt='', excerpt_html='', word_count=0, reading_time=0, list_item='')
+        out = StringIO()
+        call_command('backfill_thought_excerpts', stdout=out)
+        self.assertIn('1 thoughts backfilled', out.getvalue())
+        thought = Thought.objects.get(pk=self.thought.pk)
+        self.assertEqual((thought.word_count, thought.excerpt, thought.list_item),
+                         (self.thought.word_count, self.thought.excerpt, self.thought.list_item))
+        self.assertTrue(thought.modified > self.thought.modified)
+        
+        call_command('backfill_thought_excerpts', stdout=out)
+        self.assertEqual(Thought.objects.get(pk=self.thought.pk).modified, thought.modified)
+        
 class ThoughtManagerTest(TestCase):
     @classmethod
     def setUpClass(self):
         self.objects = [
-            {'title': 'Future Unpublished', 'pub_date': datetime.now() + timedelta(1), 'published': False},
-            {'title': 'Future Published',   'pub_date': datetime.now() + timedelta(1), 'published': True},
-            {'title': 'Past Unpublished',   'pub_date': datetime.now() - timedelta(1), 'published': False},
-            {'title': 'Past Published',     'pub_date': datetime.now() - timedelta(1), 'published': True},
+            {'title': 'Future Unpublished', 'slug': 'future-unpublished', 'pub_date': datetime.now() + timedelta(1), 'published': False},
+            {'title': 'Future Published', 'slug': 'future-published',   'pub_date': datetime.now() + timedelta(1), 'published': True},
+            {'title': 'Past Unpublished', 'slug': 'past-unpublished',   'pub_date': datetime.now() - timedelta(1), 'published': False},
+            {'title': 'Past Published', 'slug': 'past-published',     'pub_date': datetime.now() - timedelta(1), 'published': True},
         ]
         
         for object in self.objects:
@@ -119,6 +185,12 @@ class ThoughtManagerTest(TestCase):
     def test_published_returns_objects(self):
         self.assertGreater(Thought.objects.published(), 0)
     
+    def test_published_list_defers_text_columns(self):
+        '''the list querysets shouldn't load post bodies'''
+        thought = Thought.objects.published_list()[0]
+        self.assertTrue(thought._deferred)
+        self.assertEqual(Thought.objects.published_list().count(), Thought.objects.published().count())
+    
     def test_published_returns_past_published(self):
         pass
         #self.assertItemsEqual(Thought.objects.published(), Thought.objects.filter(published=True).order_by('-pub_date'))
@@ -147,10 +219,14 @@ class ThoughtsByYearTest(ArchiveCommon, TestCase):
 class ThoughtsByMonthTest(ArchiveCommon, TestCase):
     @classmethod
     def setUpClass(self, *args, **kwargs):
+        ''' ArchiveCommon's thoughts are two days apart, which may not fill two pages this month '''
         super(ThoughtsByMonthTest, self).setUpClass(*args, **kwargs)
         now = datetime.now()
         self.url = reverse('thoughts_month', args=[now.year, now.strftime('%b')])
         
+        for i in range(10):
+            self.test_objects.append(Thought.objects.create(title=i, slug='month-%s' % i, pub_date=now, published=True))
+        
         
 class ThoughtsByDayTest(ArchiveCommon, TestCase):
     @classmethod
@@ -161,9 +237,9 @@ class ThoughtsByDayTest(ArchiveCommon, TestCase):
         now = datetime.now()
         self.url = reverse('thoughts_day', args=[now.year, now.strftime('%b'), now.day])
         
-        self.test_objects = []
+        # (day, slug) is unique, so these can't reuse the slugs ArchiveCommon made for today
         for i in range(50):
-            self.test_objects.append(Thought.objects.create(title=i, slug=i, pub_date=datetime.now(), published=True))
+            self.test_objects.append(Thought.objects.create(title=i, slug='day-%s' % i, pub_date=datetime.now(), published=True))
             
 # detail views
 
@@ -187,4 +263,938 @@ class ThoughtDetailTest(ViewCommon, TestCase):
         context_variables = ['thought', 'object']
         for var in context_variables:
             self.assertIn(var, context_dictionary)
-            self.assertNotEqual(context_dictionary.get(var, ''), '')
\ No newline at end of file
+            self.assertNotEqual(context_dictionary.get(var, ''), '')
+
+class RenderCacheTest(TestCase):
+    def setUp(self):
+        self.thought = Thought()
+        
+    def test_second_render_is_a_hit(self):
+        '''rendering the same source twice should only run markdown once'''
+        before = RenderCache.objects.stats()
+        first = self.thought.render_markdown('A *cached* string')
+        second = self.thought.render_markdown('A *cached* string')
+        after = RenderCache.objects.stats()
+        self.assertEqual(first, second)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        
+    def test_fingerprint_depends_on_source(self):
+        self.assertNotEqual(rendering.fingerprint('a'), rendering.fingerprint('b'))
+        self.assertEqual(rendering.fingerprint('a'), rendering.fingerprint(u'a'))
+        
+    def test_evict_bounds_size(self):
+        for i in range(5):
+            self.thought.render_markdown('entry %s' % i)
+        RenderCache.objects.evict(max_entries=2)
+        self.assertEqual(RenderCache.objects.count(), 2)
+
+
+class RerenderThoughtsTest(TestCase):
+    def setUp(self):
+        self.thought = Thought.objects.create(title='Stale', slug='stale', pub_date=datetime.now(), content='A *test* string')
+        Thought.objects.filter(pk=self.thought.pk).update(html_content='stale')
+        
+    def test_dry_run_writes_nothing(self):
+        call_command('rerender_thoughts', dry_run=True, processes=1, stdout=StringIO())
+        self.assertEqual(Thought.objects.get(pk=self.thought.pk).html_content, 'stale')
+        
+    def test_rerenders_changed_rows(self):
+        call_command('rerender_thoughts', changed_only=True, processes=1, stdout=StringIO())
+        self.assertEqual(Thought.objects.get(pk=self.thought.pk).html_content, '<p>A <em>test</em> string</p>')
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        now = datetime.now()
+        for i in range(25):
+            # pairs share a pub_date so the id tie-break gets exercised
+            Thought.objects.create(title=i, slug=i, pub_date=now - timedelta(i // 2), published=True)
+        self.paginator = CursorPaginator(Thought.objects.published(), 10)
+        
+    def test_walks_every_thought_once(self):
+        seen = []
+        page = self.paginator.page()
+        while True:
+            seen.extend(page.object_list)
+            if not page.has_next():
+                break
+            page = self.paginator.page(after=page.next_cursor)
+        self.assertEqual([t.pk for t in seen], [t.pk for t in Thought.objects.published().order_by('-pub_date', '-pk')])
+        
+    def test_before_returns_previous_page(self):
+        first = self.paginator.page()
+        second = self.paginator.page(after=first.next_cursor)
+        self.assertEqual(list(self.paginator.page(before=second.previous_cursor)), list(first))
+        self.assertFalse(first.has_previous())
+        self.assertTrue(second.has_previous())
+        
+    def test_invalid_cursor(self):
+        self.assertRaises(InvalidCursor, self.paginator.page, after='not a cursor')
+        
+    def test_view_uses_cursors(self):
+        ThoughtsIndexView.cursor_pagination = True
+        try:
+            response = self.client.get(reverse('thoughts'))
+            page = response.context_data['page_obj']
+            self.assertTrue(response.context_data['is_paginated'])
+            response = self.client.get(reverse('thoughts'), {'after': page.next_cursor})
+            self.assertEqual(len(response.context_data['thought_list']), 10)
+            self.assertEqual(self.client.get(reverse('thoughts'), {'after': 'junk'}).status_code, 404)
+        finally:
+            ThoughtsIndexView.cursor_pagination = False
+
+
+class ArchiveCountTest(TestCase):
+    def setUp(self):
+        self.when = datetime(2010, 3, 15, 12, 0)
+        self.thought = Thought.objects.create(title='Counted', slug='counted', pub_date=self.when, published=True)
+        
+    def counts(self):
+        return dict(((c.kind, c.date), c.count) for c in ArchiveCount.objects.filter(count__gt=0))
+        
+    def test_publish_counts_every_period(self):
+        counts = self.counts()
+        self.assertEqual(counts[('year', self.when.date().replace(month=1, day=1))], 1)
+        self.assertEqual(counts[('month', self.when.date().replace(day=1))], 1)
+        self.assertEqual(counts[('day', self.when.date())], 1)
+        
+    def test_redate_moves_count(self):
+        self.thought.pub_date = datetime(2009, 1, 1)
+        self.thought.save()
+        counts = self.counts()
+        self.assertNotIn(('day', self.when.date()), counts)
+        self.assertEqual(counts[('day', datetime(2009, 1, 1).date())], 1)
+        
+    def test_unpublish_and_delete_remove_count(self):
+        self.thought.published = False
+        self.thought.save()
+        self.assertNotIn(('day', self.when.date()), self.counts())
+        self.thought.published = True
+        self.thought.save()
+        Thought.objects.get(pk=self.thought.pk).delete()
+        self.assertNotIn(('day', self.when.date()), self.counts())
+        
+    def test_rebuild_matches_incremental(self):
+        Thought.objects.create(title='Other', slug='other', pub_date=self.when, published=True)
+        Thought.objects.create(title='Draft', slug='draft', pub_date=self.when, published=False)
+        incremental = self.counts()
+        ArchiveCount.objects.rebuild()
+        self.assertEqual(self.counts(), incremental)
+        
+    def test_views_read_counts(self):
+        response = self.client.get(reverse('thoughts_year', args=[2010]))
+        self.assertEqual(response.context_data['date_list'], [datetime(2010, 3, 1)])
+        self.assertEqual(self.client.get(reverse('thoughts_year', args=[2008])).status_code, 404)
+        
+    def test_scheduled_thoughts_open_no_periods(self):
+        when = datetime.now() + timedelta(minutes=1)
+        Thought.objects.create(title='Scheduled', slug='scheduled', pub_date=when, published=True)
+        self.assertEqual(self.client.get(reverse('thoughts_year', args=[when.year])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('thoughts_month', args=[when.year, when.strftime('%b')])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('thoughts_day', args=[when.year, when.strftime('%b'), when.strftime('%d')])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('thoughts')).context_data['date_list'], [datetime(2010, 1, 1)])
+
+
+class FreezeThoughtsTest(TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.thoughts = [Thought.objects.create(title='Frozen %s' % i, slug='frozen-%s' % i, content='Thought %s' % i,
+                                                pub_date=datetime(2010, 1, 1 + i), published=True) for i in range(12)]
+        
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        
+    def freeze(self, **options):
+        stdout = StringIO()
+        call_command('freeze_thoughts', output=self.output, processes=1, stdout=stdout, **options)
+        return stdout.getvalue()
+        
+    def test_writes_every_page(self):
+        self.assertEqual(self.freeze(), '30 pages written, 0 removed, 0 unchanged\n')
+        for path in ['thoughts/index.html', 'thoughts/page-2.html', 'thoughts/2010/index.html', 'thoughts/2010/Jan/index.html',
+                     'thoughts/2010/Jan/05/index.html', 'thoughts/2010/Jan/05/frozen-4/index.html']:
+            self.assertTrue(os.path.exists(os.path.join(self.output, path)), path)
+        self.assertIn('Frozen 4', open(os.path.join(self.output, 'thoughts/2010/Jan/05/frozen-4/index.html')).read())
+        
+    def test_rebuild_only_touches_affected_pages(self):
+        self.freeze()
+        self.assertEqual(self.freeze(), '0 pages written, 0 removed, 30 unchanged\n')
+        
+        # the oldest thought is only on the last index page, its year/month/day listings and its own page;
+        # the listings show its excerpt, so they change with its content too
+        self.thoughts[0].content = 'Edited'
+        self.thoughts[0].save()
+        self.assertEqual(self.freeze(), '5 pages written, 0 removed, 25 unchanged\n')
+        # and its title is on the next thought's page, in the link back to it
+        self.thoughts[0].title = 'Retitled'
+        self.thoughts[0].save()
+        self.assertEqual(self.freeze(), '6 pages written, 0 removed, 24 unchanged\n')
+        
+        self.thoughts[0].published = False
+        self.thoughts[0].save()
+        self.assertIn('removed', self.freeze())
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'thoughts/2010/Jan/01/index.html')))
+        
+    def test_batches_plan_the_same_pages(self):
+        self.freeze(batch_size=5)
+        self.assertEqual(self.freeze(), '0 pages written, 0 removed, 30 unchanged\n')
+        
+    def test_pages_follow_the_views_page_size(self):
+        ThoughtsIndexView.paginate_by = 5
+        try:
+            self.freeze()
+            self.assertTrue(os.path.exists(os.path.join(self.output, 'thoughts/page-3.html')))
+            self.assertIn('Frozen 1<', open(os.path.join(self.output, 'thoughts/page-3.html')).read())
+        finally:
+            ThoughtsIndexView.paginate_by = 10
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        now = datetime.now()
+        self.thought = Thought.objects.create(title='Conditional', slug='conditional', pub_date=now - timedelta(1), published=True)
+        self.urls = [
+            reverse('thought', args=[self.thought.pub_date.year, self.thought.pub_date.strftime('%b'), self.thought.pub_date.strftime('%d'), 'conditional']),
+            reverse('thoughts'),
+            reverse('thoughts_year', args=[self.thought.pub_date.year]),
+        ]
+        
+    def test_etag_answers_304(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304, url)
+            
+    def test_last_modified_answers_304(self):
+        url = self.urls[0]
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304, url)
+        
+    def test_listings_change_when_their_newest_thought_goes(self):
+        # so the listings still have something to show without it
+        Thought.objects.create(title='Older', slug='older', pub_date=self.thought.pub_date - timedelta(1), published=True)
+        for url in self.urls[1:]:
+            response = self.client.get(url)
+            self.assertFalse(response.has_header('Last-Modified'), url)
+            self.thought.published = False
+            self.thought.save()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200, url)
+            self.thought.published = True
+            self.thought.save()
+            
+    def test_save_changes_etag(self):
+        for url in self.urls:
+            etag = self.client.get(url)['ETag']
+            self.thought.save()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        ResponseCacheMixin.cache_responses = True
+        self.when = datetime.now() - timedelta(1)
+        self.thought = Thought.objects.create(title='Cached', slug='cached', pub_date=self.when, published=True)
+        self.other = Thought.objects.create(title='Elsewhere', slug='elsewhere', pub_date=self.when - timedelta(400), published=True)
+        self.detail = reverse('thought', args=[self.when.year, self.when.strftime('%b'), self.when.strftime('%d'), 'cached'])
+        self.year = reverse('thoughts_year', args=[self.when.year])
+        
+    def tearDown(self):
+        ResponseCacheMixin.cache_responses = False
+        
+    def test_second_request_is_a_hit(self):
+        before = dict(thought_cache.stats['thought'])
+        first = self.client.get(self.detail)
+        second = self.client.get(self.detail)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(thought_cache.stats['thought']['hits'], before['hits'] + 1)
+        self.assertEqual(thought_cache.stats['thought']['misses'], before['misses'] + 1)
+        
+    def test_save_invalidates_only_affected_pages(self):
+        self.client.get(self.detail)
+        self.client.get(self.year)
+        self.thought.title = 'Recached'
+        self.thought.save()
+        self.assertIn('Recached', self.client.get(self.detail).content)
+        self.assertIn('Recached', self.client.get(self.year).content)
+        
+        other_year = reverse('thoughts_year', args=[self.other.pub_date.year])
+        self.client.get(other_year)
+        hits = thought_cache.stats['thoughts_year']['hits']
+        self.thought.save()
+        self.client.get(other_year)
+        self.assertEqual(thought_cache.stats['thoughts_year']['hits'], hits + 1)
+        
+    def test_delete_invalidates(self):
+        self.client.get(self.detail)
+        self.thought.delete()
+        self.assertEqual(self.client.get(self.detail).status_code, 404)
+        
+    def test_hits_answer_if_modified_since(self):
+        first = self.client.get(self.detail)
+        response = self.client.get(self.detail, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.detail)
+        self.assertEqual((response['ETag'], response['Last-Modified']), (first['ETag'], first['Last-Modified']))
+        
+    def test_rerender_invalidates(self):
+        self.client.get(self.detail)
+        Thought.objects.filter(pk=self.thought.pk).update(content='*Rerendered*')
+        call_command('rerender_thoughts', processes=1, stdout=StringIO())
+        self.assertIn('<em>Rerendered</em>', self.client.get(self.detail).content)
+        
+    def test_pages_expire_when_a_scheduled_thought_goes_live(self):
+        view = ThoughtsIndexView()
+        self.assertEqual(view.get_cache_timeout(), ResponseCacheMixin.cache_timeout)
+        Thought.objects.create(title='Scheduled', slug='scheduled', pub_date=datetime.now() + timedelta(minutes=10), published=True)
+        self.assertTrue(590 <= view.get_cache_timeout() <= 601)
+
+
+class FeedTest(TestCase):
+    def setUp(self):
+        self.thought = Thought.objects.create(title='Fed & watered', slug='fed', content='A *test* string',
+                                              pub_date=datetime.now() - timedelta(1), published=True)
+        Thought.objects.create(title='Scheduled', slug='scheduled', content='Later', pub_date=datetime.now() + timedelta(1), published=True)
+        
+    def test_entries_rendered_on_save(self):
+        self.assertIn('<title>Fed &amp; watered</title>', self.thought.atom_entry)
+        self.assertIn('&lt;em&gt;test&lt;/em&gt;', self.thought.rss_item)
+        
+    def test_saves_without_a_site(self):
+        Site.objects.all().delete()
+        Site.objects.clear_cache()
+        self.thought.save()
+        self.assertEqual((self.thought.atom_entry, self.thought.rss_item), ('', ''))
+        
+    def test_atom_feed(self):
+        response = self.client.get(reverse('thoughts_atom'))
+        self.assertEqual(response.status_code, 200)
+        # streamed, so the content can only be read once
+        content = response.content
+        self.assertTrue(content.startswith('<?xml'))
+        self.assertIn(self.thought.atom_entry.encode('utf-8'), content)
+        self.assertNotIn('Scheduled', content)
+        self.assertTrue(content.endswith('</feed>\n'))
+        
+    def test_rss_feed(self):
+        content = self.client.get(reverse('thoughts_rss')).content
+        self.assertIn(self.thought.rss_item.encode('utf-8'), content)
+        self.assertTrue(content.endswith('</rss>\n'))
+        
+    def test_conditional_get(self):
+        response = self.client.get(reverse('thoughts_atom'))
+        response = self.client.get(reverse('thoughts_atom'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        yesterday = datetime.now() - timedelta(1)
+        self.in_title = Thought.objects.create(title='Pelicans', slug='pelicans', content='Birds <b>of</b> the coast', pub_date=yesterday, published=True)
+        self.in_content = Thought.objects.create(title='Coastline', slug='coastline', content='Saw a pelican and then more pelicans', pub_date=yesterday, published=True)
+        self.draft = Thought.objects.create(title='Pelicans again', slug='draft', content='pelicans', pub_date=yesterday, published=False)
+        
+    def search(self, query):
+        return list(search.SearchResults(query)[:10])
+        
+    def test_finds_published_only(self):
+        self.assertEqual(set(t.pk for t in self.search('pelicans')), set([self.in_title.pk, self.in_content.pk]))
+        
+    def test_title_hits_rank_first(self):
+        self.assertEqual(self.search('pelicans')[0].pk, self.in_title.pk)
+        
+    def test_snippets_are_escaped_and_highlighted(self):
+        snippet = self.search('coast')[0].snippet
+        self.assertIn('<mark>coast</mark>', snippet)
+        self.assertIn('&lt;b&gt;', snippet)
+        
+    def test_index_follows_saves_and_deletes(self):
+        self.in_content.published = False
+        self.in_content.save()
+        self.assertEqual([t.pk for t in self.search('pelicans')], [self.in_title.pk])
+        self.in_title.delete()
+        self.assertEqual(self.search('pelicans'), [])
+        
+    def test_stale_entries_are_skipped(self):
+        # update() skips the signals that keep the index in step
+        Thought.objects.filter(pk=self.in_content.pk).update(published=False)
+        self.assertEqual([t.pk for t in self.search('pelicans')], [self.in_title.pk])
+        
+    def test_rebuild(self):
+        self.assertEqual(search.rebuild(), 2)
+        self.assertEqual(len(search.SearchResults('pelicans')), 2)
+        
+    def test_malformed_queries_are_harmless(self):
+        # operators are just more words to match, never syntax errors
+        self.assertEqual(self.search('"pelicans AND ( NEAR'), [])
+        self.assertEqual(len(self.search('"pelicans" (')), 2)
+        self.assertEqual(self.search('   '), [])
+        
+    def test_view(self):
+        response = self.client.get(reverse('thoughts_search'), {'q': 'pelicans'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context_data['thought_list']), 2)
+        self.assertIn('<mark>', response.content)
+
+
+
+class DetailLookupTest(TestCase):
+    def setUp(self):
+        lookup.detail_pks.clear()
+        self.when = datetime(2011, 2, 3, 12, 0)
+        self.thought = Thought.objects.create(title='Looked up', slug='looked-up', pub_date=self.when, published=True)
+        Thought.objects.create(title='Same slug, other day', slug='looked-up', pub_date=self.when + timedelta(1), published=True)
+        self.url = reverse('thought', args=[2011, 'Feb', '03', 'looked-up'])
+        
+    def test_same_slug_on_same_day_is_rejected(self):
+        clash = Thought(title='Clash', slug='looked-up', content='x', pub_date=self.when + timedelta(hours=1))
+        self.assertRaises(ValidationError, clash.full_clean)
+        self.assertRaises(IntegrityError, clash.save)
+        
+    def test_lookup_is_bounded_by_date(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.context_data['thought'].pk, self.thought.pk)
+        self.assertEqual(self.client.get(reverse('thought', args=[2011, 'Feb', '05', 'looked-up'])).status_code, 404)
+        
+    def test_pk_is_remembered_and_forgotten_on_save(self):
+        self.client.get(self.url)
+        self.assertEqual(lookup.detail_pks.get((self.when.date(), 'looked-up')), self.thought.pk)
+        self.thought.slug = 'moved'
+        self.thought.save()
+        self.assertEqual(lookup.detail_pks.get((self.when.date(), 'looked-up')), None)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        
+    def test_stale_entries_are_checked(self):
+        lookup.detail_pks.set((self.when.date(), 'looked-up'), self.thought.pk + 1)
+        self.assertEqual(self.client.get(self.url).context_data['thought'].pk, self.thought.pk)
+        
+    def test_lru_is_bounded(self):
+        cache = lookup.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        
+class NeighbourTest(TestCase):
+    def setUp(self):
+        self.when = datetime(2011, 2, 3, 12, 0)
+        self.thoughts = [Thought.objects.create(title='Neighbour %s' % i, slug='n%s' % i, content='x',
+                                                pub_date=self.when + timedelta(i), published=True)
+                         for i in range(5)]
+        
+    def links(self):
+        '''(pk, previous, next) for every thought, in publication order'''
+        return list(Thought.objects.order_by('pub_date', 'pk').values_list('pk', 'previous_thought', 'next_thought'))
+        
+    def expected_links(self):
+        pks = list(Thought.objects.filter(published=True).order_by('pub_date', 'pk').values_list('pk', flat=True))
+        links = dict((pk, (pk, before, after)) for before, pk, after in zip([None] + pks, pks, pks[1:] + [None]))
+        return [links.get(pk, (pk, None, None)) for pk, before, after in self.links()]
+        
+    def test_links_follow_publishing_redating_and_deleting(self):
+        self.assertEqual(self.links(), self.expected_links())
+        middle = self.thoughts[2]
+        middle.published = False
+        middle.save()
+        self.assertEqual(self.links(), self.expected_links())
+        middle.published = True
+        middle.pub_date = self.when + timedelta(10)
+        middle.save()
+        self.assertEqual(self.links(), self.expected_links())
+        self.assertEqual((middle.previous_thought_id, middle.next_thought_id), (self.thoughts[4].pk, None))
+        Thought.objects.get(pk=self.thoughts[0].pk).delete()
+        self.assertEqual(self.links(), self.expected_links())
+        # same pub_date: the id breaks the tie
+        Thought.objects.create(title='Tied', slug='tied', content='x', pub_date=self.thoughts[1].pub_date, published=True)
+        self.assertEqual(self.links(), self.expected_links())
+        
+    def test_saving_from_a_stale_copy_keeps_links(self):
+        stale = Thought.objects.get(pk=self.thoughts[4].pk)
+        Thought.objects.create(title='Later', slug='later', content='x', pub_date=self.when + timedelta(20), published=True)
+        stale.content = 'edited'
+        stale.save()
+        self.assertEqual(self.links(), self.expected_links())
+        
+    def test_neighbours_are_touched_only_when_their_links_change(self):
+        modified = dict(Thought.objects.values_list('pk', 'modified'))
+        self.thoughts[2].content = 'edited'
+        self.thoughts[2].save()
+        self.assertEqual(Thought.objects.get(pk=self.thoughts[1].pk).modified, modified[self.thoughts[1].pk])
+        self.thoughts[2].title = 'Retitled'
+        self.thoughts[2].save()
+        for thought in self.thoughts[1], self.thoughts[3]:
+            self.assertTrue(Thought.objects.get(pk=thought.pk).modified > modified[thought.pk])
+        self.assertEqual(Thought.objects.get(pk=self.thoughts[0].pk).modified, modified[self.thoughts[0].pk])
+        
+    def test_rebuild(self):
+        Thought.objects.update(previous_thought=None, next_thought=None)
+        self.assertEqual(Thought.objects.rebuild_neighbours(), 5)
+        self.assertEqual(self.links(), self.expected_links())
+        self.assertEqual(Thought.objects.rebuild_neighbours(), 0)
+        
+    def test_detail_page_links_without_extra_queries(self):
+        middle = self.thoughts[2]
+        url = middle.get_permalink()
+        self.client.get(url)
+        lookup.detail_pks.clear()
+        # the validators, then the thought joined to both neighbours
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertIn('href="%s" rel="prev">&larr; Neighbour 1' % self.thoughts[1].get_permalink(), response.content)
+        self.assertIn('href="%s" rel="next">Neighbour 3' % self.thoughts[3].get_permalink(), response.content)
+        
+    def test_scheduled_next_thought_is_hidden(self):
+        Thought.objects.create(title='Scheduled', slug='scheduled', content='x', pub_date=datetime.now() + timedelta(1), published=True)
+        response = self.client.get(self.thoughts[4].get_permalink())
+        self.assertEqual(response.context_data['next_thought'], None)
+        self.assertNotIn('Scheduled', response.content)
+        
+class BenchmarkTest(TestCase):
+    def test_corpus_is_complete_and_reproducible(self):
+        sources = benchmark.generate_corpus(30, seed=1, templates=5)
+        self.assertEqual(sources, benchmark.generate_corpus(0, seed=1, templates=5))
+        self.assertEqual(Thought.objects.count(), 30)
+        
+        thought = Thought.objects.published()[0]
+        self.assertEqual(thought.html_content, rendering.render(thought.content))
+        self.assertIn('<entry>', thought.atom_entry)
+        self.assertEqual(ArchiveCount.objects.filter(kind='year').count(),
+                         len(set(Thought.objects.published().dates('pub_date', 'year'))))
+        
+    def test_every_url_name_is_measured(self):
+        benchmark.generate_corpus(30, templates=5)
+        rng = Random(0)
+        for pattern in thought_urls.urlpatterns:
+            urls = benchmark.endpoint_urls(pattern.name, rng, 3)
+            self.assertTrue(urls, pattern.name)
+            stats = benchmark.measure_endpoint(urls, 3)
+            self.assertTrue(stats['queries_per_request'] > 0)
+            self.assertTrue(stats['p99_ms'] >= stats['p50_ms'])
+            
+    def test_workers_report_their_own_peak_rss(self):
+        ballast = ' ' * (64 * 1024 * 1024)
+        probe = 'from thoughts import benchmark; print benchmark.peak_rss_kb()'
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        output = subprocess.Popen([sys.executable, '-c', probe], env=env, stdout=subprocess.PIPE).communicate()[0]
+        self.assertTrue(int(output) < benchmark.peak_rss_kb() - 32 * 1024)
+        
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        instrumentation.reset()
+        Thought.objects.create(title='Measured', slug='measured', content='*hi*', pub_date=datetime(2011, 2, 3), published=True)
+        
+    def test_sampled_requests_are_recorded_by_url_name(self):
+        self.client.get(reverse('thoughts'))
+        self.client.get(reverse('thoughts'))
+        summary = instrumentation.snapshot()['thoughts']
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(sum(summary['histogram'].values()), 2)
+        self.assertTrue(summary['queries_per_request'] > 0)
+        self.assertTrue(summary['template_ms_per_request'] > 0)
+        
+    def test_template_time_through_the_response_cache(self):
+        # the cache renders the page before the middleware sees it
+        rendered_content = TemplateResponse.rendered_content
+        def slow(response):
+            time.sleep(0.02)
+            return rendered_content.fget(response)
+        TemplateResponse.rendered_content = property(slow)
+        ResponseCacheMixin.cache_responses = True
+        try:
+            self.client.get(reverse('thoughts'))
+        finally:
+            ResponseCacheMixin.cache_responses = False
+            TemplateResponse.rendered_content = rendered_content
+        self.assertTrue(instrumentation.snapshot()['thoughts']['template_ms_per_request'] >= 20)
+        
+    def test_unsampled_requests_cost_nothing(self):
+        middleware = instrumentation.InstrumentationMiddleware()
+        middleware.sample_rate = 0
+        request = RequestFactory().get(reverse('thoughts'))
+        middleware.process_request(request)
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(instrumentation.snapshot(), {})
+        
+    def test_markdown_time_is_attributed(self):
+        instrumentation.current.timers = dict((name, 0.0) for name in instrumentation.TIMERS)
+        try:
+            Thought().render_markdown('some *new* markdown')
+            self.assertTrue(instrumentation.current.timers['markdown'] > 0)
+        finally:
+            instrumentation.current.timers = None
+            
+    def test_histogram_percentiles(self):
+        record = instrumentation.Record()
+        for elapsed in [3] * 98 + [150, 9000]:
+            record.add(elapsed, 1, {})
+        self.assertEqual((record.percentile(0.5), record.percentile(0.99), record.percentile(1)), (5, 200, None))
+        
+    def test_stats_for_staff(self):
+        url = reverse('instrumentation_stats')
+        User.objects.create_superuser('staff', 'staff@example.com', 'secret')
+        self.client.login(username='staff', password='secret')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('render_cache', json.loads(response.content))
+        
+class ImportExportTest(TestCase):
+    def setUp(self):
+        self.when = datetime(2011, 2, 3, 12, 0)
+        Thought.objects.create(title='Kept', slug='kept', content='*kept*', pub_date=self.when, published=True)
+        Thought.objects.create(title='Draft', slug='draft', content='draft', pub_date=self.when)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'thoughts.jsonl')
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def load(self, *records):
+        open(self.path, 'w').write(''.join(json.dumps(record) + '\n' for record in records))
+        call_command('import_thoughts', self.path, batch_size=2, processes=1, stdout=StringIO())
+        
+    def test_round_trip(self):
+        call_command('export_thoughts', output=self.path, stdout=StringIO())
+        exported = open(self.path).read()
+        Thought.objects.all().delete()
+        call_command('import_thoughts', self.path, processes=1, stdout=StringIO())
+        
+        kept = Thought.objects.get(slug='kept')
+        self.assertEqual((kept.pub_date, kept.published, kept.html_content), (self.when, True, '<p><em>kept</em></p>'))
+        self.assertIn('<entry>', kept.atom_entry)
+        self.assertEqual(ArchiveCount.objects.get(kind='day', date=self.when.date()).count, 1)
+        call_command('export_thoughts', output=self.path, stdout=StringIO())
+        self.assertEqual(open(self.path).read(), exported)
+        
+    def test_same_day_and_slug_replaces(self):
+        pk = Thought.objects.get(slug='kept').pk
+        self.load(
+            {'title': 'New', 'slug': 'new', 'content': 'new', 'pub_date': '2011-02-04T09:00:00', 'published': True},
+            {'title': 'Kept again', 'slug': 'kept', 'content': '*again*', 'pub_date': '2011-02-03T18:00:00', 'published': True},
+            {'title': 'Kept last', 'slug': 'kept', 'content': '*last*', 'pub_date': '2011-02-03T19:00:00', 'published': True},
+        )
+        kept = Thought.objects.get(slug='kept')
+        self.assertEqual((kept.pk, kept.title, kept.html_content), (pk, 'Kept last', '<p><em>last</em></p>'))
+        self.assertEqual(Thought.objects.count(), 3)
+        self.assertEqual(search.SearchResults('new').count(), 1)
+        
+    def test_export_in_batches(self):
+        call_command('export_thoughts', output=self.path, stdout=StringIO())
+        exported = open(self.path).read()
+        call_command('export_thoughts', output=self.path, batch_size=1, stdout=StringIO())
+        self.assertEqual(open(self.path).read(), exported)
+        
+    def test_bad_line_keeps_earlier_batches_consistent(self):
+        good = [{'title': 'Good', 'slug': 'good-0', 'content': 'good', 'pub_date': '2011-02-04T09:00:00', 'published': True},
+                {'title': 'Good', 'slug': 'good-1', 'content': 'good', 'pub_date': '2011-02-04T10:00:00', 'published': True}]
+        open(self.path, 'w').write(''.join(json.dumps(record) + '\n' for record in good + [{'title': 'Bad'}]))
+        # call_command turns the CommandError into an exit
+        self.assertRaises(SystemExit, call_command, 'import_thoughts', self.path, batch_size=2, processes=1,
+                          stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(ArchiveCount.objects.get(kind='day', date=datetime(2011, 2, 4).date()).count, 2)
+        self.assertEqual(search.SearchResults('good').count(), 2)
+        first = Thought.objects.get(slug='good-0')
+        self.assertEqual(first.next_thought_id, Thought.objects.get(slug='good-1').pk)
+        
+    def test_bad_lines_are_reported(self):
+        parse = import_thoughts.Command().parse
+        self.assertRaises(CommandError, parse, 1, 'not json')
+        self.assertRaises(CommandError, parse, 1, json.dumps({'title': 'No date', 'slug': 'no-date', 'content': 'x'}))
+        self.assertRaises(CommandError, parse, 1, json.dumps({'title': 'x', 'slug': 'x', 'content': 'x', 'pub_date': 'soon'}))
+        self.assertRaises(CommandError, parse, 1, json.dumps({'title': 'x' * 81, 'slug': 'x', 'content': 'x', 'pub_date': '2011-02-04'}))
+        
+class HighlightTest(TestCase):
+    def setUp(self):
+        highlight.blocks.clear()
+        
+    def test_output_matches_codehilite(self):
+        for source in ['    :::python\n    x = "<b>"', '    #!python\n    x = 1', '    :::nosuchlang\n    a & b',
+                       '    #!/usr/bin/env python\n    print 1', '\tplain <code>']:
+            self.assertEqual(rendering.render(source), markdown.markdown(source, rendering.EXTENSIONS))
+            
+    def test_blocks_are_reused_across_posts(self):
+        code = '\n\n    :::python\n    def f():\n        return 1'
+        rendering.render('First post.' + code)
+        misses = highlight.blocks.misses
+        rendering.render('Second, different post.' + code)
+        self.assertEqual(highlight.blocks.misses, misses)
+        self.assertEqual(len(highlight.blocks), 1)
+        
+    def test_cache_is_bounded_by_size(self):
+        cache = highlight.SizedLRUCache(10)
+        cache.set(('a',), 'xxxx')
+        cache.set(('b',), 'xxxx')
+        cache.set(('c',), 'xxxx')
+        self.assertEqual((cache.get(('a',)), cache.get(('c',)), cache.size), (None, 'xxxx', 10))
+        cache.set(('d',), 'x' * 20)
+        self.assertEqual(cache.get(('d',)), None)
+        
+class IncrementalRenderTest(TestCase):
+    def setUp(self):
+        incremental.blocks.clear()
+        
+    def test_output_matches_a_full_render(self):
+        for source in ['Footnotes[^b] in [order][r].\n\n[^a]: First\n\nAnother[^a]\n\n[^b]: Second\n    indented\n\n[r]: http://example.com "T"',
+                       '* one\n\n* two\n\n    more of two\n\n1. three',
+                       '> quoted\n\n> still quoted\n\nNot quoted',
+                       '    :::python\n    x = 1\n\n\n\n    y = 2\n\nText & <span>inline</span>',
+                       'Before\n\n<div>\n\nraw *html*\n\n</div>\n\nAfter[^n]\n\n[^n]: Note',
+                       'Setext\n======\n\n---\n\n## Hash\n\nline  \nbreak', '', '\n\n']:
+            self.assertEqual(incremental.render(source), rendering.render(source))
+            # and again, from the cache
+            self.assertEqual(incremental.render(source), rendering.render(source))
+            
+    def test_only_changed_blocks_are_rendered(self):
+        paragraphs = ['Paragraph %s with a footnote[^%s].' % (i, i) for i in range(10)]
+        notes = ['[^%s]: Note %s' % (i, i) for i in range(10)]
+        incremental.render('\n\n'.join(paragraphs + notes))
+        misses = incremental.blocks.misses
+        paragraphs[5] = 'An *edited* paragraph[^5].'
+        source = '\n\n'.join(paragraphs + notes)
+        self.assertEqual(incremental.render(source), rendering.render(source))
+        self.assertEqual(incremental.blocks.misses, misses + 1)
+        
+    def test_new_footnote_renumbers_later_blocks(self):
+        source = 'One[^a]\n\nTwo[^b]\n\n[^a]: A\n\n[^b]: B'
+        incremental.render(source)
+        # footnotes are numbered in the order they're defined
+        source = 'Zero[^z]\n\n[^z]: Z\n\n' + source
+        html = incremental.render(source)
+        self.assertEqual(html, rendering.render(source))
+        self.assertIn('href="#fn:b" rel="footnote">3</a>', html)
+        
+    def test_render_cache_misses_render_incrementally(self):
+        Thought(content='x').render_markdown('Cached by *block*')
+        self.assertEqual(len(incremental.blocks), 1)
+        
+class SitemapTest(TestCase):
+    def setUp(self):
+        self.thoughts = [Thought.objects.create(title='Mapped %s' % i, slug='mapped-%s' % i, content='x', published=True,
+                                                pub_date=datetime(2011, 2, 3 + i, 12, 0)) for i in range(3)]
+        Thought.objects.create(title='Draft', slug='draft', content='x', pub_date=datetime(2011, 2, 3))
+        
+    def tearDown(self):
+        sitemaps.LIMIT = 50000
+        sitemaps.BATCH_SIZE = 1000
+        
+    def test_thoughts_are_read_in_batches(self):
+        first = self.client.get(reverse('thoughts_sitemap')).content
+        thought_cache.cache.clear()
+        sitemaps.BATCH_SIZE = 2
+        self.assertEqual(self.client.get(reverse('thoughts_sitemap')).content, first)
+        
+    def test_single_sitemap_lists_thoughts_and_archives(self):
+        content = self.client.get(reverse('thoughts_sitemap')).content
+        self.assertIn('<urlset', content)
+        self.assertIn(self.thoughts[0].get_permalink() + '</loc><lastmod>', content)
+        for url in [reverse('thoughts'), reverse('thoughts_year', args=[2011]), reverse('thoughts_day', args=[2011, 'Feb', '05'])]:
+            self.assertIn(url + '</loc>', content)
+        self.assertNotIn('draft', content)
+        
+    def test_unchanged_sitemap_comes_from_the_cache(self):
+        first = self.client.get(reverse('thoughts_sitemap')).content
+        # the signature and the archive count, nothing else
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(reverse('thoughts_sitemap')).content, first)
+        self.thoughts[0].title = 'Renamed'
+        self.thoughts[0].slug = 'renamed'
+        self.thoughts[0].save()
+        self.assertIn('renamed', self.client.get(reverse('thoughts_sitemap')).content)
+        
+    def test_large_sites_get_an_index(self):
+        sitemaps.LIMIT = 2
+        content = self.client.get(reverse('thoughts_sitemap')).content
+        self.assertIn('<sitemapindex', content)
+        self.assertIn(reverse('thoughts_sitemap_archives'), content)
+        shards = [reverse('thoughts_sitemap_shard', args=[number]) for number in range(3)]
+        self.assertEqual([shard in content for shard in shards], [True, True, False])
+        self.assertEqual(self.client.get(shards[0]).content.count('<url>'), 2)
+        self.assertEqual(self.client.get(shards[2]).status_code, 404)
+        self.assertIn(reverse('thoughts_month', args=[2011, 'Feb']), self.client.get(reverse('thoughts_sitemap_archives')).content)
+        
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        connections.databases[snapshot.ALIAS] = {'ENGINE': 'django.db.backends.sqlite3',
+                                                 'NAME': os.path.join(self.directory, 'snapshot.db')}
+        connections.ensure_defaults(snapshot.ALIAS)
+        yesterday = datetime.now() - timedelta(1)
+        self.thought = Thought.objects.create(title='Pelicans', slug='pelicans', content='Birds of the coast', pub_date=yesterday, published=True)
+        self.draft = Thought.objects.create(title='Draft', slug='draft', content='pelicans', pub_date=yesterday, published=False)
+        
+    def tearDown(self):
+        snapshot.serving.alias = None
+        if snapshot.ALIAS in connections._connections:
+            connections[snapshot.ALIAS].close()
+            del connections._connections[snapshot.ALIAS]
+        del connections.databases[snapshot.ALIAS]
+        shutil.rmtree(self.directory)
+        
+    def test_publish_copies_published_thoughts(self):
+        self.assertFalse(snapshot.available())
+        self.assertEqual(snapshot.publish(), 1)
+        self.assertTrue(snapshot.available())
+        published = Thought.objects.using(snapshot.ALIAS)
+        self.assertEqual(list(published.values_list('pk', 'html_content')),
+                         [(self.thought.pk, Thought.objects.get(pk=self.thought.pk).html_content)])
+        self.assertEqual(ArchiveCount.objects.using(snapshot.ALIAS).count(), ArchiveCount.objects.count())
+        self.assertFalse(os.path.exists(snapshot.path() + '.%s.tmp' % os.getpid()))
+        
+    def test_publish_copies_in_batches(self):
+        for i in range(4):
+            Thought.objects.create(title='More %s' % i, slug='more-%s' % i, content='x', pub_date=datetime(2011, 2, 3), published=True)
+        snapshot.BATCH_SIZE = 2
+        try:
+            self.assertEqual(snapshot.publish(), 5)
+        finally:
+            snapshot.BATCH_SIZE = 1000
+        self.assertEqual(Thought.objects.using(snapshot.ALIAS).count(), 5)
+        
+    def test_snapshot_is_read_only(self):
+        snapshot.publish()
+        cursor = connections[snapshot.ALIAS].cursor()
+        self.assertRaises(DatabaseError, cursor.execute, 'DELETE FROM thoughts_thought')
+        
+    def test_public_pages_read_the_snapshot_until_it_is_republished(self):
+        snapshot.publish()
+        self.thought.title = 'Retitled'
+        self.thought.save()
+        url = self.thought.get_permalink()
+        self.assertContains(self.client.get(url), 'Pelicans')
+        self.assertEqual([t.pk for t in self.client.get(reverse('thoughts_search'), {'q': 'pelicans'}).context_data['object_list']],
+                         [self.thought.pk])
+        snapshot.publish()
+        self.assertContains(self.client.get(url), 'Retitled')
+        # the request is over, so everything else is back on the primary
+        self.assertEqual(Thought.objects.count(), 2)
+        
+    def test_writes_and_the_admin_use_the_primary(self):
+        snapshot.publish()
+        snapshot.SnapshotMiddleware().process_request(RequestFactory().get('/admin/thoughts/thought/'))
+        self.assertEqual(snapshot.serving.alias, None)
+        snapshot.SnapshotMiddleware().process_request(RequestFactory().get(reverse('thoughts')))
+        self.assertEqual(Thought.objects.count(), 1)
+        self.assertEqual(router.db_for_write(Thought), 'default')
+        snapshot.finished(None)
+        self.assertEqual(Thought.objects.count(), 2)
+        
+class SchemaTest(TestCase):
+    def test_migrations_keep_thought_indexes(self):
+        from south.db import db
+        if db.backend_name != 'sqlite3':
+            return
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [schema.TABLE])
+        names = set(name for name, in cursor.fetchall())
+        for columns in schema.INDEXES:
+            self.assertIn(db.create_index_name(schema.TABLE, columns), names)
+        
+class StartupTest(TestCase):
+    def test_serving_code_does_not_import_markdown(self):
+        probe = ('import sys; import thoughts.models, thoughts.views, thoughts.urls, thoughts.instrumentation; '
+                 'print [name for name in ("markdown", "pygments") if name in sys.modules]')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        output = subprocess.Popen([sys.executable, '-c', probe], env=env, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(output.strip(), '[]')
+
+
+class RenderQueueTest(TestCase):
+    def setUp(self):
+        self.workers = tasks.workers
+        # the test database isn't visible to other threads
+        tasks.workers = 0
+        Thought.async_render = True
+        self.when = datetime.now() - timedelta(1)
+        self.thought = Thought.objects.create(title='Queued', slug='queued', content='*first*', pub_date=self.when, published=True)
+        self.url = reverse('thought', args=[self.when.year, self.when.strftime('%b'), self.when.strftime('%d'), 'queued'])
+        
+    def tearDown(self):
+        Thought.async_render = False
+        tasks.workers = self.workers
+        ThoughtDetailView.serve_stale = False
+        
+    def test_save_defers_rendering(self):
+        self.assertEqual(self.thought.html_content, '')
+        self.assertTrue(self.thought.render_pending)
+        self.assertEqual(RenderTask.objects.count(), 1)
+        
+        self.assertEqual(tasks.drain(), 1)
+        thought = Thought.objects.get(pk=self.thought.pk)
+        self.assertEqual(thought.html_content, rendering.render('*first*'))
+        self.assertFalse(thought.render_pending)
+        self.assertIn('first', thought.atom_entry)
+        self.assertTrue(thought.modified > self.thought.modified)
+        self.assertEqual(RenderTask.objects.count(), 0)
+        
+    def test_one_render_covers_every_queued_version(self):
+        self.thought.content = '*second*'
+        self.thought.save()
+        self.assertEqual(tasks.drain(), 1)
+        self.assertEqual(RenderTask.objects.count(), 0)
+        self.assertIn('second', Thought.objects.get(pk=self.thought.pk).html_content)
+        
+    def render_while_modified(self, task, saved_again):
+        original = Thought.objects.get
+        def moved_on(**kwargs):
+            thought = original(**kwargs)
+            modified = thought.modified + timedelta(seconds=1)
+            Thought.objects.filter(pk=thought.pk).update(modified=modified)
+            if saved_again:
+                RenderTask.objects.create(thought=thought, modified=modified)
+            return thought
+        Thought.objects.get = moved_on
+        try:
+            return tasks.render(task)
+        finally:
+            del Thought.objects.get
+            
+    def test_task_superseded_by_a_later_save_is_dropped(self):
+        task = RenderTask.objects.claim()
+        self.assertFalse(self.render_while_modified(task, saved_again=True))
+        self.assertFalse(RenderTask.objects.filter(pk=task.pk).exists())
+        self.assertEqual(Thought.objects.get(pk=self.thought.pk).html_content, '')
+        self.assertEqual(RenderTask.objects.count(), 1)
+        
+    def test_task_interrupted_otherwise_is_requeued(self):
+        # a neighbour being relinked touches `modified` without queueing anything
+        task = RenderTask.objects.claim()
+        self.assertFalse(self.render_while_modified(task, saved_again=False))
+        self.assertEqual(RenderTask.objects.get(pk=task.pk).claimed, None)
+        self.assertEqual(tasks.drain(), 1)
+        self.assertFalse(Thought.objects.get(pk=self.thought.pk).render_pending)
+        
+    def test_detail_renders_pending_thoughts_on_demand(self):
+        self.assertIn('<em>first</em>', self.client.get(self.url).content)
+        
+    def test_detail_can_serve_stale_html(self):
+        tasks.drain()
+        thought = Thought.objects.get(pk=self.thought.pk)
+        thought.content = '*second*'
+        thought.save()
+        ThoughtDetailView.serve_stale = True
+        self.assertIn('<em>first</em>', self.client.get(self.url).content)
+        ThoughtDetailView.serve_stale = False
+        self.assertIn('<em>second</em>', self.client.get(self.url).content)
+        
+    def test_feeds_skip_thoughts_never_rendered(self):
+        self.assertNotIn('<entry>', self.client.get(reverse('thoughts_atom')).content)
+        tasks.drain()
+        self.assertIn('<entry>', self.client.get(reverse('thoughts_atom')).content)
+        
+    def test_failures_are_retried_then_reported(self):
+        def broken(self, input):
+            raise ValueError('no markdown today')
+        original = Thought.__dict__['render_markdown']
+        Thought.render_markdown = broken
+        try:
+            self.assertEqual(tasks.drain(), 3)
+        finally:
+            Thought.render_markdown = original
+        task = RenderTask.objects.failed().get()
+        self.assertIn('no markdown today', task.error)
+        self.assertEqual(RenderTask.objects.claim(), None)
+        
+        out = StringIO()
+        call_command('drain_render_queue', retry_failed=True, stdout=out)
+        self.assertIn('Processed 1 tasks, 0 still queued', out.getvalue())
+        self.assertFalse(Thought.objects.get(pk=self.thought.pk).render_pending)
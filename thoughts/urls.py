@@ -1,9 +1,16 @@
 from django.conf.urls.defaults import patterns, include, url
 
-from thoughts.views import ThoughtsIndexView, ThoughtsByYearView, ThoughtsByMonthView, ThoughtsByDayView, ThoughtDetailView
+from thoughts import feeds, sitemaps
+from thoughts.views import ThoughtsIndexView, ThoughtsByYearView, ThoughtsByMonthView, ThoughtsByDayView, ThoughtDetailView, ThoughtSearchView
 
 urlpatterns = patterns('thoughts.views',
     url(r'^$', ThoughtsIndexView.as_view(), name='thoughts'),
+    url(r'^feeds/atom/$', feeds.atom, name='thoughts_atom'),
+    url(r'^feeds/rss/$', feeds.rss, name='thoughts_rss'),
+    url(r'^sitemap\.xml$', sitemaps.sitemap, name='thoughts_sitemap'),
+    url(r'^sitemap-archives\.xml$', sitemaps.sitemap_archives, name='thoughts_sitemap_archives'),
+    url(r'^sitemap-(?P<number>\d+)\.xml$', sitemaps.sitemap_shard, name='thoughts_sitemap_shard'),
+    url(r'^search/$', ThoughtSearchView.as_view(), name='thoughts_search'),
     url(r'^(?P<year>\d{4})/$', ThoughtsByYearView.as_view(), name='thoughts_year'),
     url(r'^(?P<year>\d{4})/(?P<month>\w{3})/$', ThoughtsByMonthView.as_view(), name='thoughts_month'),
     url(r'^(?P<year>\d{4})/(?P<month>\w{3})/(?P<day>\d{2})/$', ThoughtsByDayView.as_view(), name='thoughts_day'),
@@ -1,40 +1,368 @@
 import datetime
+import hashlib
+import time
 
-from django.http import Http404
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse
 from django.shortcuts import render_to_response
-from django.views.generic import ArchiveIndexView, YearArchiveView, MonthArchiveView, DayArchiveView, DetailView
+from django.views.decorators.http import condition
+from django.utils.http import urlencode
+from django.views.generic import ArchiveIndexView, YearArchiveView, MonthArchiveView, DayArchiveView, DetailView, ListView
 
-from thoughts.models import Thought
+from thoughts import cache, instrumentation, lookup, search, snapshot
+from thoughts.models import Thought, ArchiveCount
+from thoughts.pagination import CursorPaginator, InvalidCursor
 
-class ThoughtsIndexView(ArchiveIndexView):
-    queryset = Thought.objects.published()
+class CursorPaginationMixin(object):
+    '''
+    opt-in keyset pagination: with `cursor_pagination` on, pages are addressed
+    by ?after=/?before= cursors instead of ?page=N.
+    '''
+    cursor_pagination = getattr(settings, 'THOUGHTS_CURSOR_PAGINATION', False)
+    
+    def paginate_queryset(self, queryset, page_size):
+        # the index and year views re-order by pub_date alone; put the id
+        # tie-break back so page boundaries are stable
+        queryset = queryset.order_by('-pub_date', '-id')
+        if not self.cursor_pagination:
+            return super(CursorPaginationMixin, self).paginate_queryset(queryset, page_size)
+        
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+class ArchiveCountMixin(object):
+    '''
+    answer the "which periods have posts" questions (date_list, empty-period
+    404s, next/previous links) from ArchiveCount instead of scanning thoughts
+    '''
+    def get_period(self):
+        '''(start, end) dates of the period in the URL, or (None, None) for the index'''
+        if 'year' not in self.kwargs:
+            return None, None
+        try:
+            year = int(self.kwargs['year'])
+            if 'month' not in self.kwargs:
+                return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+            month = time.strptime(self.kwargs['month'], self.get_month_format()).tm_mon
+            if 'day' not in self.kwargs:
+                start = datetime.date(year, month, 1)
+                return start, (start + datetime.timedelta(days=31)).replace(day=1)
+            start = datetime.date(year, month, int(self.kwargs['day']))
+            return start, start + datetime.timedelta(days=1)
+        except ValueError:
+            raise Http404('Invalid date')
+            
+    def get_archive_counts(self, kind, start=None, end=None):
+        qs = ArchiveCount.objects.filter(kind=kind, count__gt=0)
+        if start:
+            qs = qs.filter(date__gte=start)
+        if end:
+            qs = qs.filter(date__lt=end)
+        if not self.get_allow_future():
+            qs = qs.filter(date__lte=datetime.date.today())
+            # the counts include scheduled thoughts, so the period holding
+            # today may have nothing visible in it yet
+            current = dict(ArchiveCount.objects.periods(datetime.datetime.now()))[kind]
+            if (not start or start <= current) and (not end or current < end) and not self.has_visible_since(current):
+                qs = qs.exclude(date=current)
+        return qs
+        
+    def has_visible_since(self, date):
+        if not hasattr(self, '_visible_since'):
+            self._visible_since = {}
+        if date not in self._visible_since:
+            self._visible_since[date] = Thought.objects.filter(published=True,
+                pub_date__gte=datetime.datetime.combine(date, datetime.time.min),
+                pub_date__lte=datetime.datetime.now()).exists()
+        return self._visible_since[date]
+        
+    def get_dated_queryset(self, **lookup):
+        qs = self.get_queryset().filter(**lookup)
+        if not self.get_allow_future():
+            qs = qs.filter(**{'%s__lte' % self.get_date_field(): datetime.datetime.now()})
+        
+        if not self.get_allow_empty() and not self.get_archive_counts('day', *self.get_period()).exists():
+            raise Http404('No thoughts available')
+        return qs
+        
+    def get_date_list(self, queryset, date_type):
+        dates = self.get_archive_counts(date_type, *self.get_period()).order_by('-date').values_list('date', flat=True)
+        # queryset.dates() hands back datetimes, so templates see the same thing
+        date_list = [datetime.datetime.combine(date, datetime.time.min) for date in dates]
+        if not date_list and not self.get_allow_empty():
+            raise Http404('No thoughts available')
+        return date_list
+        
+    def get_adjacent_date(self, naive, is_previous, use_first_day):
+        '''same rules as the generic views' next/previous month and day links'''
+        if self.get_allow_empty():
+            result = naive
+        else:
+            counts = self.get_archive_counts('day')
+            if is_previous:
+                dates = counts.filter(date__lte=naive).order_by('-date')
+            else:
+                dates = counts.filter(date__gte=naive).order_by('date')
+            dates = list(dates.values_list('date', flat=True)[:1])
+            result = dates and dates[0] or None
+            
+        if result and use_first_day:
+            result = result.replace(day=1)
+        if result and (self.get_allow_future() or result < datetime.date.today()):
+            return result
+        return None
+        
+    def get_next_month(self, date):
+        next = (date.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+        return self.get_adjacent_date(next, is_previous=False, use_first_day=True)
+        
+    def get_previous_month(self, date):
+        prev = date.replace(day=1) - datetime.timedelta(days=1)
+        return self.get_adjacent_date(prev, is_previous=True, use_first_day=True)
+        
+    def get_next_day(self, date):
+        return self.get_adjacent_date(date + datetime.timedelta(days=1), is_previous=False, use_first_day=False)
+        
+    def get_previous_day(self, date):
+        return self.get_adjacent_date(date - datetime.timedelta(days=1), is_previous=True, use_first_day=False)
+        
+class ConditionalGetMixin(object):
+    '''
+    answer If-None-Match / If-Modified-Since with a 304 from one aggregate
+    query, before the list query runs or any template renders. Archive views
+    get their period from ArchiveCountMixin.get_period().
+    
+    Listings only send an ETag: the newest `modified` among the rows they
+    list goes backwards when that thought is deleted or unpublished, so it
+    can't be a Last-Modified. The count in the ETag catches those.
+    '''
+    def get_validator_queryset(self):
+        qs = Thought.objects.filter(published=True)
+        start, end = self.get_period()
+        if start:
+            qs = qs.filter(pub_date__gte=start)
+        if end:
+            qs = qs.filter(pub_date__lt=end)
+        if not self.get_allow_future():
+            qs = qs.filter(pub_date__lte=datetime.datetime.now())
+        return qs
+        
+    def get_validators(self):
+        '''(etag, last modified) for the request, or (None, None) if there is nothing to show'''
+        if not hasattr(self, '_validators'):
+            found = self.get_validator_queryset().aggregate(count=Count('id'), modified=Max('modified'), pub_date=Max('pub_date'))
+            if not found['count']:
+                self._validators = (None, None)
+            else:
+                # a scheduled thought appearing changes the page without touching `modified`
+                newest = max(found['modified'], found['pub_date'])
+                etag = hashlib.md5('%s|%s' % (found['count'], newest.isoformat())).hexdigest()
+                self._validators = (etag, None)
+        return self._validators
+        
+    def dispatch(self, request, *args, **kwargs):
+        # View.dispatch() would set these, but the validators need them first
+        self.request, self.args, self.kwargs = request, args, kwargs
+        view = super(ConditionalGetMixin, self).dispatch
+        return condition(
+            etag_func=lambda request, *args, **kwargs: self.get_validators()[0],
+            last_modified_func=lambda request, *args, **kwargs: self.get_validators()[1],
+        )(view)(request, *args, **kwargs)
+        
+class ResponseCacheMixin(object):
+    '''
+    serve whole rendered pages out of the cache backend, keyed by the
+    generations of get_cache_scopes() (see thoughts.cache). Nothing bumps a
+    scope when a scheduled thought goes live, so pages are never cached past
+    the next scheduled pub_date.
+    '''
+    cache_responses = getattr(settings, 'THOUGHTS_CACHE_RESPONSES', False)
+    cache_timeout = getattr(settings, 'THOUGHTS_CACHE_TIMEOUT', 60 * 60 * 24)
+    url_name = None
+    
+    def get_cache_scopes(self):
+        start, end = self.get_period()
+        if 'day' in self.kwargs:
+            return [start.strftime('day:%Y-%m-%d')]
+        if 'month' in self.kwargs:
+            return [start.strftime('month:%Y-%m')]
+        if 'year' in self.kwargs:
+            return [start.strftime('year:%Y')]
+        return ['index']
+        
+    def dispatch(self, request, *args, **kwargs):
+        if not self.cache_responses or request.method != 'GET':
+            return super(ResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+        
+        self.request, self.args, self.kwargs = request, args, kwargs
+        key = cache.response_key(self.url_name, request.get_full_path(), self.get_cache_scopes() + snapshot.cache_scopes())
+        cached = cache.cache.get(key)
+        if cached is not None:
+            cache.stats[self.url_name]['hits'] += 1
+            etag, last_modified = cached['validators']
+            def cached_response(request, *args, **kwargs):
+                return HttpResponse(cached['content'], content_type=cached['content_type'])
+            # the same If-None-Match / If-Modified-Since handling as a miss
+            return condition(
+                etag_func=lambda request, *args, **kwargs: etag,
+                last_modified_func=lambda request, *args, **kwargs: last_modified,
+            )(cached_response)(request, *args, **kwargs)
+            
+        cache.stats[self.url_name]['misses'] += 1
+        response = super(ResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            if hasattr(response, 'render'):
+                # the instrumentation middleware only sees it rendered
+                with instrumentation.timed('template'):
+                    response.render()
+            cache.cache.set(key, {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'validators': getattr(self, '_validators', (None, None)),
+            }, self.get_cache_timeout())
+        return response
+        
+    def get_cache_timeout(self):
+        timeout = self.cache_timeout
+        scheduled = Thought.objects.next_scheduled()
+        if scheduled:
+            until = scheduled - datetime.datetime.now()
+            # at least a second: the cache backends read 0 as their default timeout
+            timeout = min(timeout, max(1, until.days * 86400 + until.seconds + 1))
+        return timeout
+        
+class ThoughtsIndexView(ResponseCacheMixin, ConditionalGetMixin, CursorPaginationMixin, ArchiveCountMixin, ArchiveIndexView):
+    url_name = 'thoughts'
+    queryset = Thought.objects.published_list()
     date_field = 'pub_date'
     context_object_name = 'thought_list'
     paginate_by = 10
     
-class ThoughtsByYearView(YearArchiveView):
+class ThoughtsByYearView(ResponseCacheMixin, ConditionalGetMixin, CursorPaginationMixin, ArchiveCountMixin, YearArchiveView):
+    url_name = 'thoughts_year'
     date_field = 'pub_date'
-    queryset = Thought.objects.published()
+    queryset = Thought.objects.published_list()
     make_object_list = True
     paginate_by = 10
     
-class ThoughtsByMonthView(MonthArchiveView):
+class ThoughtsByMonthView(ResponseCacheMixin, ConditionalGetMixin, CursorPaginationMixin, ArchiveCountMixin, MonthArchiveView):
+    url_name = 'thoughts_month'
     date_field = 'pub_date'
-    queryset = Thought.objects.published()
+    queryset = Thought.objects.published_list()
     make_object_list = True
     paginate_by = 10
     context_object_name = 'thought_list'
     
-class ThoughtsByDayView(DayArchiveView):
+class ThoughtsByDayView(ResponseCacheMixin, ConditionalGetMixin, CursorPaginationMixin, ArchiveCountMixin, DayArchiveView):
+    url_name = 'thoughts_day'
     date_field = 'pub_date'
-    queryset = Thought.objects.published()
+    queryset = Thought.objects.published_list()
     make_object_list = True
     paginate_by = 10
     context_object_name = 'thought_list'
     
-class ThoughtDetailView(DetailView):
-    queryset = Thought.objects.published()
+class ThoughtDetailView(ResponseCacheMixin, ConditionalGetMixin, DetailView):
+    url_name = 'thought'
+    # the neighbours come along for the previous/next links. Deferring their
+    # bodies would be nice, but this version of Django then defers the same
+    # fields on the thought itself, since it's the same model.
+    queryset = Thought.objects.published().select_related('previous_thought', 'next_thought')
+    # while a thought waits in the render queue, show its previous HTML
+    # instead of rendering it for the request
+    serve_stale = getattr(settings, 'THOUGHTS_ASYNC_RENDER_SERVE_STALE', False)
+    
+    def get_day(self):
+        try:
+            return datetime.date(*time.strptime('%(year)s %(month)s %(day)s' % self.kwargs, '%Y %b %d')[:3])
+        except ValueError:
+            raise Http404('Invalid date')
+            
+    def get_cache_scopes(self):
+        return [cache.thought_scope(self.get_day(), self.kwargs['slug'])]
+        
+    def get_validator_queryset(self):
+        return self.get_queryset().filter(pub_day=self.get_day(), slug=self.kwargs['slug'])
+        
+    def get_validators(self):
+        '''
+        as for the listings, except that the next link appearing when a
+        scheduled thought goes live changes the page too
+        '''
+        if not hasattr(self, '_validators'):
+            found = list(self.get_validator_queryset().values_list('modified', 'pub_date', 'next_thought__pub_date')[:1])
+            if not found:
+                self._validators = (None, None)
+            else:
+                modified, pub_date, next_date = found[0]
+                last_modified = max(modified, pub_date)
+                if next_date and next_date <= datetime.datetime.now():
+                    last_modified = max(last_modified, next_date)
+                etag = hashlib.md5('1|%s' % last_modified.isoformat()).hexdigest()
+                self._validators = (etag, last_modified)
+        return self._validators
+        
+    def get_context_data(self, **kwargs):
+        context = super(ThoughtDetailView, self).get_context_data(**kwargs)
+        next = self.object.next_thought
+        context['previous_thought'] = self.object.previous_thought
+        # don't give away scheduled thoughts
+        context['next_thought'] = next and next.pub_date <= datetime.datetime.now() and next or None
+        return context
+        
+    def get_object(self, queryset=None):
+        thought = self.find_object(queryset)
+        if thought.render_pending and not (self.serve_stale and thought.html_content):
+            # goes through the render cache, so the queue's turn is then cheap
+            thought.html_content = thought.render_markdown(thought.content)
+        return thought
+        
+    def find_object(self, queryset=None):
+        '''
+        resolve through the unique (pub_day, slug) index, remembering the
+        primary key so the next hit is a single primary key fetch
+        '''
+        if queryset is None:
+            queryset = self.get_queryset()
+        key = (self.get_day(), self.kwargs['slug'])
+        
+        pk = lookup.detail_pks.get(key)
+        if pk is not None:
+            try:
+                thought = queryset.get(pk=pk)
+                # another process may have re-dated or re-slugged it
+                if (thought.pub_day, thought.slug) == key:
+                    return thought
+            except Thought.DoesNotExist:
+                pass
+            lookup.detail_pks.discard_value(pk)
+            
+        try:
+            thought = queryset.get(pub_day=key[0], slug=key[1])
+        except Thought.DoesNotExist:
+            raise Http404('No thought found matching the query')
+        lookup.detail_pks.set(key, thought.pk)
+        return thought
+        
+class ThoughtSearchView(ListView):
+    template_name = 'thoughts/thought_search.html'
+    context_object_name = 'thought_list'
+    paginate_by = 10
     
+    def get_queryset(self):
+        return search.SearchResults(self.request.GET.get('q', ''))
+        
+    def get_context_data(self, **kwargs):
+        context = super(ThoughtSearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', '')
+        context['query'] = query
+        context['query_string'] = urlencode({'q': query}) + '&'
+        return context
+        
 #def thoughts(request, year=None, month=None, day=None, template='thoughts/index.html'):
 #    thoughts = Thought.objects.published()
 #    
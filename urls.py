@@ -1,15 +1,18 @@
 from django.conf.urls.defaults import patterns, include, url
 
+from brianhicks import urls_public
+
 # Uncomment the next two lines to enable the admin:
 from django.contrib import admin
 admin.autodiscover()
 
-urlpatterns = patterns('',
-    url(r'^thoughts/', include('thoughts.urls')),
-
+urlpatterns = urls_public.urlpatterns + patterns('',
     # Uncomment the admin/doc line below to enable admin documentation:
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
 
+    # request timings from thoughts.instrumentation, for staff
+    url(r'^admin/stats/$', 'thoughts.instrumentation.stats', name='instrumentation_stats'),
+
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
 )
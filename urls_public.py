@@ -0,0 +1,7 @@
+from django.conf.urls.defaults import patterns, include, url
+
+# Just the public site. Workers that never serve the admin can set
+# DJANGO_ROOT_URLCONF=brianhicks.urls_public and skip loading it at all.
+urlpatterns = patterns('',
+    url(r'^thoughts/', include('thoughts.urls')),
+)